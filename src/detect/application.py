@@ -21,14 +21,83 @@ from matplotlib.figure import Figure
 from matplotlib.backend_bases import key_press_handler
 
 # Own utils for creating and saving spectrograms and saving wave files
-from spectrogram_utils import make_spectrogram, save_spectrogram
+from spectrogram_utils import (
+    load_spectrogram, plot_spectrogram, save_spectrogram, update_spectrogram)
+
+# Own module for keeping spectrograms, so revisited files aren't recomputed
+from spectrogram_cache import SpectrogramCache
 
 # File inspection
 from os import listdir
 from os.path import splitext
 
+# For computing upcoming spectrograms in the background
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+# Number of files after the current one whose spectrograms are prefetched
+NUM_PREFETCHED = 8
+
     
 ### Classes ###
+class Prefetcher:
+    '''
+    Loads spectrograms of files on a background thread before they are
+    needed, so that moving to the next file doesn't wait for the file to
+    be read and its spectrogram computed.
+    
+    load is a function that returns the spectrogram of the file at a path
+    '''
+    
+    def __init__(self, load):
+        self._load = load
+        self._executor = ThreadPoolExecutor(1)
+        self._futures = {} # path: Future of its spectrogram
+        self._generation = 0
+        
+    def prefetch(self, paths):
+        '''Starts loading the spectrograms of paths in the background, in
+        order, forgetting any others being loaded'''
+        
+        for path in list(self._futures):
+            if path not in paths:
+                self._futures.pop(path).cancel()
+                
+        for path in paths:
+            if path not in self._futures:
+                self._futures[path] = self._executor.submit(
+                    self._load_current, self._generation, path)
+    
+    def _load_current(self, generation, path):
+        # Work queued before cancel() is skipped
+        if generation != self._generation:
+            return None
+        return self._load(path)
+        
+    def get(self, path):
+        '''Returns the spectrogram of path, waiting for it if it is being
+        loaded in the background, and loading it now if it isn't'''
+        
+        future = self._futures.pop(path, None)
+        
+        if future is not None:
+            try:
+                spectrogram = future.result()
+            except CancelledError:
+                spectrogram = None
+            if spectrogram is not None:
+                return spectrogram
+            
+        return self._load(path)
+        
+    def cancel(self):
+        '''Forgets all spectrograms being loaded, e.g. when the files to
+        be viewed change'''
+        self._generation += 1
+        for future in self._futures.values():
+            future.cancel()
+        self._futures = {}
+    
+    
 class Application:
 
     def __init__(self, master=None):
@@ -36,6 +105,11 @@ class Application:
         self.position = 0
         self.files = []
         
+        # Made once, since scanning the cache's directory takes a while
+        self.cache = SpectrogramCache()
+        self.prefetcher = Prefetcher(
+            lambda path: load_spectrogram(path, self.cache))
+        
         # Create self.frame with buttons
         self.frame = Tk.Frame()
         self.create_buttons()
@@ -73,26 +147,66 @@ class Application:
         self.fig = Figure(dpi=100)
         self.ax = self.fig.add_subplot(111)
         
+        # The image of the spectrogram shown, made once and then reused
+        # (see show_spectrogram()), and the figure without it
+        self.image = None
+        self.background = None
+        
         # Create a tk.DrawingArea
         self.canvas = FigureCanvasTkAgg(self.fig, master=self.master)
+        self.canvas.mpl_connect('draw_event', self.on_draw)
         self.canvas.show()
         self.canvas.get_tk_widget().pack(side=Tk.TOP, fill=Tk.BOTH, expand=1)
         #self.canvas._tkcanvas.pack(side=Tk.TOP, fill=Tk.BOTH, expand=1)
     
     def draw_example_fig(self):
         '''Draw an example figure to test drawing functionality'''
-        self.fig.clear()
-        self.ax = self.fig.add_subplot(111)    
         path = "C:/Users/tessa/drive/red-crossbills/crossbill-detect/detections/smaller_sample_2936ms.wav"
-        self.fig = make_spectrogram(path, self.fig, self.ax)
-        self.fig.canvas.draw()
+        self.show_spectrogram(load_spectrogram(path, self.cache))
         
     def draw_speck(self, path):
-        '''Draw the spectrogram of the wav file at path'''
-        self.fig.clear()
-        self.ax = self.fig.add_subplot(111)
-        self.fig = make_spectrogram(path, self.fig, self.ax)
-        self.fig.canvas.draw()
+        '''Draw the spectrogram of the wav file at path, and start loading
+        the spectrograms of the files after it in self.files'''
+        self.show_spectrogram(self.prefetcher.get(path))
+        
+        next_position = self.position + 1
+        self.prefetcher.prefetch(
+            self.files[next_position:next_position + NUM_PREFETCHED])
+    
+    def show_spectrogram(self, spectrogram):
+        '''Shows a spectrogram from load_spectrogram(). After the first,
+        spectrograms are shown by updating the same image and drawing only
+        it over the rest of the figure (blitting), so showing one takes the
+        same short time however many have been shown'''
+        
+        if self.image is None:
+            self.image = plot_spectrogram(spectrogram, self.fig, self.ax)
+            # Left out of full draws of the figure, and drawn over them
+            self.image.set_animated(True)
+            self.canvas.draw()
+            return
+        
+        update_spectrogram(self.image, spectrogram)
+        
+        if self.background is None:
+            self.canvas.draw()
+        else:
+            self.canvas.restore_region(self.background)
+            self.draw_image()
+            self.canvas.blit(self.fig.bbox)
+            
+    def on_draw(self, event):
+        '''Keeps the figure as drawn without the image whenever it is drawn
+        in full (e.g. when the window is resized), and draws the image'''
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        if self.image is not None:
+            self.draw_image()
+            
+    def draw_image(self):
+        '''Draws the image, and the frame of the axes that goes over it'''
+        self.ax.draw_artist(self.image)
+        for spine in self.ax.spines.values():
+            self.ax.draw_artist(spine)
     
     def load_file(self):
         '''Open dialog to load & view file'''
@@ -104,6 +218,9 @@ class Application:
     def load_folder(self):
         '''Open dialog to load & view folder, and display first image'''
         dirname = fd.askdirectory()
+        
+        # The same prefetcher, and its thread, serve every folder
+        self.prefetcher.cancel()
         self.position = 0
         self.files = []
         
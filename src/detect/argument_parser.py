@@ -2,6 +2,9 @@
 from os import path
 import argparse
 
+# The call types the detector has settings for
+from old_bird_detector_redux_1_1 import CROSSBILL_TYPES
+
 def is_directory(pathname):
     '''Returns True if pathname is an existing directory, False otherwise'''
     if path.exists(pathname):
@@ -34,7 +37,7 @@ def input_validation():
     '''
     # initialize ArgumentParser
     parser = argparse.ArgumentParser(
-        description='Detect crossbill calls from 16-bit wav files. \
+        description='Detect crossbill calls from 16-, 24-, or 32-bit wav files. \
             Can be run with a single .wav file or with a folder of .wav files.', add_help=True)
     
     # add optional "verbose" flag
@@ -46,11 +49,62 @@ def input_validation():
     files.add_argument('-f', '--file', metavar='FILE.wav', type=_parse_directory, action='store', dest='file',
         help='detect calls in a .wav file')
     files.add_argument('-d', '--dir', metavar='DIRECTORY/', type=_parse_file, action='store', dest='dir',
-        help='detect calls in all .wav files within directory')
+        help='detect calls in all .wav files within directory and its subdirectories')
+    files.add_argument('--file-list', metavar='FILE', type=str, action='store', dest='file_list',
+        help='detect calls in the files listed in FILE, one per line, or "-" to read the list from standard input')
+    
+    # add optional patterns for choosing the files to detect calls in with -d
+    parser.add_argument('--include', metavar='PATTERN', type=str, action='append', dest='include',
+        help='with -d, only process files whose paths within the directory match this pattern, e.g. "2018-*/*.wav" (may be given more than once; default "*.wav")')
+    parser.add_argument('--exclude', metavar='PATTERN', type=str, action='append', dest='exclude',
+        help='with -d, skip files whose paths within the directory match this pattern (may be given more than once)')
         
-    # add argument for which type is in the file (currently nothing is done with this information)
-    parser.add_argument('-t', '--type', metavar='TYPE', type=int, action='store', dest='type', 
-        help='a crossbill call type from 1 to 10')
+    # add argument for which types to detect in the file
+    parser.add_argument('-t', '--type', metavar='TYPE', type=int, nargs='+', choices=CROSSBILL_TYPES, action='store', dest='type', 
+        help='crossbill call types to detect in a single pass (one or more of {}; default 2)'.format(
+            ', '.join(str(t) for t in CROSSBILL_TYPES)))
+    
+    # add optional flag to process files at a reduced sample rate
+    parser.add_argument('--decimate', action='store_true', dest='decimate',
+        help='decimate input to the lowest sample rate the detector settings allow (faster for high sample rates)')
+    
+    # add optional floating point type for signal processing
+    parser.add_argument('--dtype', type=str, choices=['float64', 'float32'], action='store', dest='dtype', default='float64',
+        help='floating point type to process samples in; float32 uses less memory and is faster (default float64)')
+    
+    # add optional format for saving detections
+    parser.add_argument('--clips', type=str, choices=['wav', 'archive', 'none'], action='store', dest='clips', default='wav',
+        help="save detections as a .wav file apiece, in one .clips archive per recording, or not at all, only listing them in the manifest (default wav)")
+    
+    # add optional path for the manifest listing all detections of the run
+    parser.add_argument('--manifest', metavar='FILE.csv', type=str, action='store', dest='manifest',
+        help='list detections in this .csv file (default: manifest.csv in the run directory)')
+    
+    # add optional flag to save detections as mono rather than two-channel files
+    parser.add_argument('--mono', action='store_true', dest='mono',
+        help='save .wav files with one channel rather than two identical channels')
+    
+    # add optional ledger of files already processed, and a flag to ignore it
+    parser.add_argument('--ledger', metavar='FILE.sqlite', type=str, action='store', dest='ledger',
+        help='with -d or --file-list, skip files this ledger lists as processed with the same settings, and add newly processed files to it (default: ledger.sqlite alongside the run directories)')
+    parser.add_argument('--force', action='store_true', dest='force',
+        help='with -d or --file-list, process every file, even those the ledger lists as processed')
+    
+    # add optional clip archive to export .wav files from
+    parser.add_argument('--export-archive', metavar='FILE.clips', type=str, action='store', dest='export_archive',
+        help='save each clip in a .clips archive as a .wav file, then exit')
+    
+    # add optional directory for caching designed filters between runs
+    parser.add_argument('--filter-cache', metavar='DIRECTORY/', type=str, action='store', dest='filter_cache',
+        help='cache designed detector filters in this directory, for reuse in later runs')
+    
+    # add argument for the number of files to process at once
+    parser.add_argument('-j', '--jobs', metavar='N', type=int, action='store', dest='jobs', default=1,
+        help='number of processes to run detection in when using -d (default 1)')
+    
+    # add argument for the number of processes to split each file between
+    parser.add_argument('--segments', metavar='N', type=int, action='store', dest='segments', default=1,
+        help='split each file into N segments processed at once in separate processes, for long files (default 1; ignored with -j)')
     args = parser.parse_args()
     return vars(args)
     
\ No newline at end of file
@@ -3,10 +3,15 @@ Copied from Harold Mill's Vesper project: https://github.com/HaroldMills/Vesper/
 
 Functions pertaining to audio files.
 
-For the time being, only 16-bit .wav files are supported.
+Files with 16-, 24-, or 32-bit integer samples or 32-bit floating point
+samples can be read, including RF64 files. Files are always written with
+16-bit samples.
 '''
 
 
+import os
+import struct
+
 import numpy as np
 import wave
 
@@ -30,60 +35,334 @@ def is_wave_file_path(path):
 
 
 def get_wave_file_info(path):
-    with wave.open(path, 'rb') as reader:
-        return _read_header(reader, check_format=False)
+    return _read_riff_header(path)
 
 
-def _read_header(reader, check_format=True):
-    
-    p = reader.getparams()
-        
-    sample_size = p.sampwidth * 8
+# Types of the sample arrays returned for the supported combinations of
+# compression type and sample size. 24-bit samples are decoded to 32
+# bits (see `_decode_int24_samples`).
+_SAMPLE_DTYPES = {
+    ('NONE', 16): np.dtype('<i2'),
+    ('NONE', 24): np.dtype('<i4'),
+    ('NONE', 32): np.dtype('<i4'),
+    ('FLOAT', 32): np.dtype('<f4'),
+}
+
 
-    if check_format:
-        _check_wave_file_format(sample_size, p.comptype)
-    
-    sample_rate = float(p.framerate)
-    
-    return Bunch(
-        num_channels=p.nchannels,
-        length=p.nframes,
-        sample_size=sample_size,
-        sample_rate=sample_rate,
-        compression_type=p.comptype,
-        compression_name=p.compname)
- 
- 
 def _check_wave_file_format(sample_size, compression_type):
     
-    if sample_size != 16:
+    if compression_type not in ('NONE', 'FLOAT'):
         raise UnsupportedAudioFileFormatError(
-            ('Audio file has unsupported sample size of {} bits. Only '
-             '16-bit samples are currently supported.').format(sample_size))
+            'Audio file compression type is not "NONE" or "FLOAT". Only '
+            'uncompressed audio files are currently supported.')
         
-    if compression_type != 'NONE':
+    if (compression_type, sample_size) not in _SAMPLE_DTYPES:
         raise UnsupportedAudioFileFormatError(
-            'Audio file compression type is not "NONE". Only uncompressed '
-            'audio files are currently supported.')
+            ('Audio file has unsupported sample size of {} bits. Only '
+             '16-, 24-, and 32-bit integer samples and 32-bit floating '
+             'point samples are currently supported.').format(sample_size))
 
 
 def read_wave_file(path):
     
-    with wave.open(path, 'rb') as reader:
-        info = _read_header(reader)
-        samples = _read_samples(reader, info.length, info.num_channels)
+    info = _read_riff_header(path)
+    
+    _check_wave_file_format(info.sample_size, info.compression_type)
+    
+    with open(path, 'rb') as file_:
+        file_.seek(info.data_offset)
+        samples = _read_samples(file_, info, info.length)
     
     return (samples, info.sample_rate)
     
     
-def _read_samples(reader, length, num_channels):
-    string = reader.readframes(length)
-    samples = np.frombuffer(string, dtype=_WAVE_SAMPLE_DTYPE)
-    if num_channels == 1:
-        samples = samples.reshape((num_channels, length))
+def read_wave_file_mmap(path):
+    
+    """
+    Reads a wave file without loading its samples into memory.
+    
+    This function is like `read_wave_file`, except that the returned
+    samples array is a read-only view of a `numpy.memmap` of the data
+    chunk of the file rather than an in-memory copy of it. The rows of
+    the array are strided views of the interleaved channels of the file,
+    so slicing a channel reads only the slice from disk.
+    
+    Packed 24-bit samples cannot be viewed as a NumPy array without
+    decoding them, so for 24-bit files the returned samples are an
+    `_Int24Samples` object instead, which decodes samples only when
+    they are indexed.
+    """
+    
+    info = _read_riff_header(path)
+    
+    _check_wave_file_format(info.sample_size, info.compression_type)
+    
+    dtype = _SAMPLE_DTYPES[(info.compression_type, info.sample_size)]
+    shape = (info.length, info.num_channels)
+    
+    if info.length == 0:
+        # `np.memmap` cannot map zero bytes
+        samples = np.zeros(shape, dtype=dtype)
+        
+    elif info.sample_size == 24:
+        data = np.memmap(
+            path, dtype=np.uint8, mode='r', offset=info.data_offset,
+            shape=shape + (3,))
+        return (_Int24Samples(data), info.sample_rate)
+        
     else:
-        samples = samples.reshape((length, num_channels)).transpose()
-    return samples
+        samples = np.memmap(
+            path, dtype=dtype, mode='r', offset=info.data_offset,
+            shape=shape)
+        
+    return (samples.transpose(), info.sample_rate)
+    
+    
+class _Int24Samples:
+    
+    """
+    Memory-mapped 24-bit samples, decoded when indexed.
+    
+    An `_Int24Samples` object can be indexed like the
+    `(num_channels, length)` sample arrays returned by
+    `read_wave_file_mmap` for other sample sizes: indexing it with a
+    channel number yields a one-dimensional `_Int24Samples` object for
+    that channel, and indexing that yields `int32` samples, decoded from
+    only the indexed part of the file.
+    """
+    
+    
+    dtype = _SAMPLE_DTYPES[('NONE', 24)]
+    
+    
+    def __init__(self, data, channel_num=None):
+        
+        # `uint8` array of shape (length, num_channels, 3)
+        self._data = data
+        
+        self._channel_num = channel_num
+        
+        
+    @property
+    def shape(self):
+        length, num_channels, _ = self._data.shape
+        if self._channel_num is None:
+            return (num_channels, length)
+        else:
+            return (length,)
+        
+        
+    @property
+    def ndim(self):
+        return len(self.shape)
+    
+    
+    def __len__(self):
+        return self.shape[0]
+    
+    
+    def __getitem__(self, key):
+        
+        if self._channel_num is not None:
+            return _decode_int24_samples(self._data[key, self._channel_num])
+        
+        elif isinstance(key, tuple) and len(key) == 2:
+            channel_num, key = key
+            return self[channel_num][key]
+        
+        elif isinstance(key, (int, np.integer)):
+            channel_num = range(len(self))[key]
+            return _Int24Samples(self._data, channel_num)
+        
+        else:
+            return np.asarray(self)[key]
+        
+        
+    def __array__(self, dtype=None, copy=None):
+        if self._channel_num is None:
+            samples = _decode_int24_samples(self._data).transpose()
+        else:
+            samples = self[:]
+        return samples if dtype is None else samples.astype(dtype)
+    
+    
+def _decode_int24_samples(data):
+    
+    """
+    Decodes packed little-endian 24-bit samples.
+    
+    `data` is a `uint8` array whose last axis has length three, holding
+    the bytes of one sample. Each sample is copied into the upper three
+    bytes of a 32-bit integer, so the samples are decoded with a single
+    vectorized copy, sign and all. The decoded samples are thus scaled
+    like 32-bit samples, i.e. they are 256 times the 24-bit samples.
+    """
+    
+    data = np.asarray(data)
+    samples = np.zeros(data.shape[:-1] + (4,), dtype=np.uint8)
+    samples[..., 1:] = data
+    return samples.view(_SAMPLE_DTYPES[('NONE', 24)])[..., 0]
+
+
+def samples_to_int16(samples):
+    
+    """
+    Converts samples read by this module to 16 bits.
+    
+    32-bit integer samples (including decoded 24-bit samples) are taken
+    to use the full 32-bit range, and floating point samples the range
+    [-1, 1]. 16-bit samples are returned as is, without copying them.
+    """
+    
+    samples = np.asarray(samples)
+    
+    if samples.dtype.kind == 'f':
+        samples = np.clip(np.round(samples * 32768), -32768, 32767)
+        return samples.astype(_WAVE_SAMPLE_DTYPE)
+    
+    elif samples.dtype.itemsize == 4:
+        return (samples >> 16).astype(_WAVE_SAMPLE_DTYPE)
+    
+    else:
+        return samples.astype(_WAVE_SAMPLE_DTYPE, copy=False)
+    
+    
+_WAVE_FORMAT_PCM = 1
+_WAVE_FORMAT_IEEE_FLOAT = 3
+_WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+_RF64_SIZE_PLACEHOLDER = 0xFFFFFFFF
+
+
+def _read_riff_header(path):
+    
+    """
+    Reads the header of a RIFF or RF64 wave file.
+    
+    This function does not use the `wave` module, which supports
+    neither floating point samples nor RF64 files (the 64-bit variant
+    of the wave format used for files of more than four gigabytes). In
+    addition to the usual file information, it returns the byte offset
+    of the data chunk of the file and the size of a sample frame.
+    """
+    
+    file_size = os.path.getsize(path)
+    
+    with open(path, 'rb') as file_:
+        
+        header = file_.read(12)
+        
+        if len(header) < 12:
+            raise AudioFileFormatError('File is not a RIFF wave file.')
+        
+        riff_id, _, wave_id = struct.unpack('<4sI4s', header)
+        
+        if riff_id not in (b'RIFF', b'RF64') or wave_id != b'WAVE':
+            raise AudioFileFormatError('File is not a RIFF wave file.')
+        
+        fmt = None
+        
+        # size of data chunk from RF64 "ds64" chunk
+        ds64_data_size = None
+        
+        while True:
+            
+            header = file_.read(8)
+            
+            if len(header) < 8:
+                raise AudioFileFormatError('Wave file has no data chunk.')
+            
+            chunk_id, chunk_size = struct.unpack('<4sI', header)
+            
+            if chunk_id == b'fmt ':
+                fmt = file_.read(chunk_size)
+                file_.seek(chunk_size % 2, os.SEEK_CUR)
+                
+            elif chunk_id == b'ds64':
+                ds64 = file_.read(16)
+                if len(ds64) < 16:
+                    raise AudioFileFormatError(
+                        'RF64 wave file ds64 chunk is too short.')
+                _, ds64_data_size = struct.unpack('<QQ', ds64)
+                file_.seek(chunk_size - 16 + chunk_size % 2, os.SEEK_CUR)
+                
+            elif chunk_id == b'data':
+                data_offset = file_.tell()
+                if riff_id == b'RF64' and \
+                        chunk_size == _RF64_SIZE_PLACEHOLDER:
+                    if ds64_data_size is None:
+                        raise AudioFileFormatError(
+                            'RF64 wave file has no ds64 chunk.')
+                    data_size = ds64_data_size
+                else:
+                    data_size = chunk_size
+                break
+            
+            else:
+                # Skip chunk, including any pad byte.
+                file_.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+                
+    if fmt is None:
+        raise AudioFileFormatError('Wave file has no format chunk.')
+    
+    if len(fmt) < 16:
+        raise AudioFileFormatError('Wave file format chunk is too short.')
+    
+    format_tag, num_channels, sample_rate, _, block_size, sample_size = \
+        struct.unpack('<HHIIHH', fmt[:16])
+    
+    if format_tag == _WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+        # The format is the first two bytes of the subformat GUID.
+        format_tag, = struct.unpack('<H', fmt[24:26])
+    
+    if format_tag == _WAVE_FORMAT_PCM:
+        compression_type = 'NONE'
+        compression_name = 'not compressed'
+    elif format_tag == _WAVE_FORMAT_IEEE_FLOAT:
+        compression_type = 'FLOAT'
+        compression_name = 'IEEE floating point'
+    else:
+        compression_type = '0x{:04X}'.format(format_tag)
+        compression_name = 'unknown'
+        
+    if block_size == 0:
+        raise AudioFileFormatError('Wave file has a block size of zero.')
+    
+    # Ignore any part of the data chunk that is missing from the file,
+    # as happens for example when a recorder is interrupted before it
+    # can update the file header.
+    data_size = min(data_size, file_size - data_offset)
+    
+    return Bunch(
+        num_channels=num_channels,
+        length=data_size // block_size,
+        sample_size=sample_size,
+        sample_rate=float(sample_rate),
+        compression_type=compression_type,
+        compression_name=compression_name,
+        data_offset=data_offset,
+        block_size=block_size)
+    
+    
+def _read_samples(file_, info, length):
+    
+    """
+    Reads `length` sample frames from the current position of a wave
+    file, returning them as a `(num_channels, length)` array.
+    """
+    
+    data = file_.read(length * info.block_size)
+    
+    if info.sample_size == 24:
+        data = np.frombuffer(data, dtype=np.uint8)
+        data = data.reshape((length, info.num_channels, 3))
+        samples = _decode_int24_samples(data)
+    else:
+        dtype = _SAMPLE_DTYPES[(info.compression_type, info.sample_size)]
+        samples = np.frombuffer(data, dtype=dtype)
+        samples = samples.reshape((length, info.num_channels))
+        
+    return samples.transpose()
 
 
 def write_wave_file(path, samples, sample_rate):
@@ -116,12 +395,14 @@ def _write_samples(writer, samples):
     else:
         samples = samples.transpose().reshape(-1)
         
-    # Ensure that samples are of the correct type.
-    if samples.dtype != _WAVE_SAMPLE_DTYPE:
-        samples = np.array(samples, dtype=_WAVE_SAMPLE_DTYPE)
+    # Ensure that samples are of the correct type, and contiguous.
+    # Samples that already are (e.g. a slice of a mono file's samples)
+    # are not copied.
+    samples = np.ascontiguousarray(samples, dtype=_WAVE_SAMPLE_DTYPE)
         
-    # Convert samples to string.
-    samples = samples.tostring()
+    # Get bytes of samples. (`ndarray.tostring`, used previously, was
+    # removed from NumPy, and copied the samples.)
+    samples = memoryview(samples).cast('B')
     
     # Write to file.
     # This appears to slow down by about an order of magnitude after
@@ -144,25 +425,74 @@ def copy_wave_file_channel(
         input_file_path, channel_num, output_file_path,
         chunk_size=_DEFAULT_CHUNK_SIZE):
     
-    """Copies one channel of an existing audio file to a new audio file."""
+    """
+    Copies one channel of an existing audio file to a new audio file.
+    
+    The new file always has 16-bit samples (see `samples_to_int16`).
+    """
+    
+    
+    info = get_wave_file_info(input_file_path)
+    
+    with wave.open(output_file_path, 'wb') as writer:
+        
+        _write_header(writer, 1, info.sample_rate)
+        
+        for _, samples in read_wave_file_blocks(
+                input_file_path, channel_num, chunk_size):
+            
+            _write_samples(writer, samples_to_int16(samples)[np.newaxis])
+
+
+def read_wave_file_blocks(
+        path, channel_num=0, block_size=_DEFAULT_CHUNK_SIZE, overlap=0):
+    
+    """
+    Generates blocks of samples of one channel of an existing audio file.
+    
+    Each item generated is a `(start_index, samples)` pair, where
+    `samples` is a one-dimensional array of at most `block_size`
+    consecutive samples of the specified channel and `start_index` is
+    the index in the channel of the first of them. Consecutive blocks
+    overlap by `overlap` samples. Only the current block is held in
+    memory, however long the file.
+    """
+    
+    if not 0 <= overlap < block_size:
+        raise ValueError(
+            'Block overlap must be nonnegative and less than block size.')
     
+    info = _read_riff_header(path)
     
-    with wave.open(input_file_path, 'rb') as reader:
+    _check_wave_file_format(info.sample_size, info.compression_type)
+    
+    dtype = _SAMPLE_DTYPES[(info.compression_type, info.sample_size)]
+    
+    with open(path, 'rb') as file_:
+        
+        file_.seek(info.data_offset)
+        
+        start_index = 0
+        overlap_samples = np.zeros(0, dtype=dtype)
         
-        info = _read_header(reader)
+        remaining = info.length
         
-        with wave.open(output_file_path, 'wb') as writer:
+        while remaining != 0:
             
-            _write_header(writer, 1, info.sample_rate)
+            n = min(remaining, block_size - len(overlap_samples))
             
-            remaining = info.length
+            samples = _read_samples(file_, info, n)
+            channel_samples = samples[channel_num]
             
-            while remaining != 0:
+            if len(overlap_samples) != 0:
+                channel_samples = np.concatenate(
+                    (overlap_samples, channel_samples))
                 
-                n = min(remaining, chunk_size)
-                
-                samples = _read_samples(reader, n, info.num_channels)
-                channel_samples = samples[channel_num]
-                _write_samples(writer, channel_samples)
+            yield (start_index, channel_samples)
+            
+            remaining -= n
+            
+            if overlap != 0:
+                overlap_samples = channel_samples[-overlap:]
                 
-                remaining -= n
+            start_index += len(channel_samples) - len(overlap_samples)
@@ -0,0 +1,73 @@
+'''
+check_export_names.py
+
+Checks that exporting the spectrograms of a manifest (see
+export_spectrograms.py) saves an image for every clip when recordings
+in different directories have the same file name, as "n1/rec.wav" and
+"n2/rec.wav" do, with detections at the same offsets in each.
+
+Usage:
+$ python check_export_names.py
+
+The recordings and the manifest are made in a temporary directory, and
+deleted afterwards. Exits with status 1 if any image is missing.
+'''
+
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+from audio_file_utils import write_wave_file
+from clip_store import ManifestWriter
+from export_spectrograms import export_spectrograms, _get_manifest_images
+
+
+_SAMPLE_RATE = 22050
+
+# (start index, length) pairs of the detections in each recording
+_DETECTIONS = [(1000, 2000), (20000, 2000)]
+
+
+def check_export_names(dir_path):
+    '''Exports the spectrograms of the clips of two recordings named
+    "rec.wav" in dir_path, printing the results. Returns whether every
+    clip has an image of its own'''
+
+    manifest_path = os.path.join(dir_path, 'manifest.csv')
+
+    with ManifestWriter(manifest_path) as manifest:
+        for name in ('n1', 'n2'):
+            recording_path = os.path.join(dir_path, name, 'rec.wav')
+            os.makedirs(os.path.dirname(recording_path))
+            samples = np.random.randint(-3000, 3000, (1, _SAMPLE_RATE * 2))
+            write_wave_file(recording_path, samples.astype('int16'),
+                _SAMPLE_RATE)
+            manifest.append_detections(recording_path, _SAMPLE_RATE,
+                'type2', _DETECTIONS)
+
+    images, run_dir = _get_manifest_images(
+        manifest_path, os.path.join(dir_path, 'spectrograms'))
+    num_saved = export_spectrograms(images, manifest_path)
+
+    image_paths = {image_path for _, image_path in images}
+    num_found = sum(os.path.isfile(path) for path in image_paths)
+
+    print("{} clips: {} image paths, {} saved, {} found in '{}/'".format(
+        len(images), len(image_paths), num_saved, num_found, run_dir))
+
+    return len(image_paths) == num_found == num_saved == len(images)
+
+
+def main():
+
+    with tempfile.TemporaryDirectory() as dir_path:
+        same = check_export_names(dir_path)
+
+    print('images distinct' if same else 'images MISSING')
+    sys.exit(0 if same else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+'''
+check_segments.py
+
+Checks that detecting in segments of a recording (see the --segments
+option of crossbill_detector.py) finds exactly what detecting in the
+whole recording does: the same threshold crossings in every segment,
+and the same clips.
+
+Usage:
+$ python check_segments.py <recording.wav>
+$ python check_segments.py <recording.wav> -t 2 6 --segments 2 3 7 --block-size 200000
+$ python check_segments.py <recording.wav> --decimate --dtype float32
+
+Segments are processed one after another here, rather than in worker
+processes, since only their results matter. Smaller block sizes than the
+detector's split a recording into more segments, so check more of them.
+Exits with status 1 if anything differs, or if the recording is too
+short to split into segments of whole blocks, so nothing is compared.
+'''
+
+import argparse
+import sys
+
+import numpy as np
+
+from audio_file_utils import read_wave_file_mmap
+from crossbill_detector import (
+    get_detector_settings, get_segment_bounds, BLOCK_SIZE)
+from old_bird_detector_redux_1_1 import (
+    get_segment_crossings, MultiDetector, CROSSBILL_TYPES)
+
+
+class _Listener:
+    '''Keeps the clips a detector finds'''
+
+    def __init__(self):
+        self.detections = []
+
+    def append_detection(self, start_index, length):
+        self.detections.append((start_index, length))
+
+
+def _detect_whole(settings, sample_rate, channel, block_size, **options):
+    '''Returns the clips found in a channel processed in blocks, as by
+    crossbill_detector.detect_from_file(), for each settings'''
+
+    listeners = [_Listener() for _ in settings]
+    detector = MultiDetector(settings, sample_rate, listeners, **options)
+
+    for start in range(0, len(channel), block_size):
+        detector.detect(np.asarray(channel[start:start + block_size]))
+    detector.complete_detection()
+
+    return [listener.detections for listener in listeners]
+
+
+def _detect_in_segments(settings, sample_rate, channel, bounds, block_size,
+    **options):
+    '''Returns the crossings found in each segment, and the clips found in
+    them, for each settings'''
+
+    listeners = [_Listener() for _ in settings]
+    detector = MultiDetector(settings, sample_rate, listeners, **options)
+
+    all_crossings = []
+
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        crossings = get_segment_crossings(settings, sample_rate, channel,
+            start, end, block_size, **options)
+        detector.process_segment_crossings(crossings)
+        all_crossings.append(crossings)
+
+    detector.complete_detection()
+
+    return (all_crossings, [listener.detections for listener in listeners])
+
+
+def _join_crossings(segments_crossings):
+    '''Joins the crossings of consecutive segments, for each detector'''
+    joined = []
+    for detector_crossings in zip(*segments_crossings):
+        joined.append((
+            np.concatenate([c[0] for c in detector_crossings]),
+            np.concatenate([c[1] for c in detector_crossings]),
+            detector_crossings[-1][2]))
+    return joined
+
+
+def _same_crossings(a, b):
+    return all(np.array_equal(x[0], y[0]) and np.array_equal(x[1], y[1])
+               and x[2] == y[2] for x, y in zip(a, b))
+
+
+def check_segments(file_path, types, segment_counts, block_size,
+    decimate = False, dtype = 'float64'):
+    '''Compares detecting in segments of the first channel of a recording
+    with detecting in the whole of it, for each number of segments in
+    segment_counts, printing the results. Returns whether they are all
+    the same, and False if any number of segments doesn't split the
+    recording, since then nothing is compared'''
+
+    (samples, sample_rate) = read_wave_file_mmap(file_path)
+    channel = samples[0]
+
+    settings = [s for _, s in get_detector_settings(None, types)]
+    options = dict(decimate=decimate, dtype=dtype)
+
+    # A single segment is the whole recording, processed block by block
+    whole_crossings = get_segment_crossings(settings, sample_rate, channel,
+        0, len(channel), block_size, **options)
+    whole_clips = _detect_whole(settings, sample_rate, channel, block_size,
+        **options)
+
+    print("{}: {} samples at {} Hz, {} clips".format(file_path,
+        len(channel), sample_rate, sum(len(clips) for clips in whole_clips)))
+
+    all_same = True
+
+    for num_segments in segment_counts:
+
+        bounds = get_segment_bounds(len(channel), num_segments, block_size)
+
+        # e.g. for recordings of a single block
+        if len(bounds) < 3:
+            print("{} segments: not split, since the recording has only "
+                "{} block(s) of {} samples (try a smaller --block-size)".format(
+                num_segments, -(-len(channel) // block_size), block_size))
+            all_same = False
+            continue
+
+        segments_crossings, clips = _detect_in_segments(settings,
+            sample_rate, channel, bounds, block_size, **options)
+
+        same_crossings = _same_crossings(
+            _join_crossings(segments_crossings), whole_crossings)
+        same_clips = clips == whole_clips
+        all_same &= same_crossings and same_clips
+
+        print("{} segments: crossings {}, clips {}".format(len(bounds) - 1,
+            'same' if same_crossings else 'DIFFERENT',
+            'same' if same_clips else 'DIFFERENT'))
+
+    return all_same
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description='Check that detecting in segments of a recording finds \
+            the same crossings and clips as detecting in all of it.',
+        add_help=True)
+    parser.add_argument('recording', help='a .wav file')
+    parser.add_argument('-t', '--type', metavar='TYPE', type=int, nargs='+',
+        choices=CROSSBILL_TYPES, dest='type',
+        help='crossbill call types to detect (default: type 2)')
+    parser.add_argument('--segments', metavar='N', type=int, nargs='+',
+        default=[2, 3, 5], dest='segments',
+        help='numbers of segments to check (default: 2 3 5)')
+    parser.add_argument('--block-size', metavar='SAMPLES', type=int,
+        default=BLOCK_SIZE, dest='block_size',
+        help='samples per block (default: {})'.format(BLOCK_SIZE))
+    parser.add_argument('--decimate', action='store_true', dest='decimate',
+        help='decimate input, as crossbill_detector.py --decimate does')
+    parser.add_argument('--dtype', choices=['float64', 'float32'],
+        default='float64', dest='dtype',
+        help='floating point type to process samples in (default float64)')
+    input = vars(parser.parse_args())
+
+    same = check_segments(input['recording'], input['type'],
+        input['segments'], input['block_size'], input['decimate'],
+        input['dtype'])
+
+    sys.exit(0 if same else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+'''
+clip_archive.py
+
+Single-file storage for the clips detected in a recording.
+
+Writing every detection to its own .wav file gets slow once a run has
+written many thousands of small files. A clip archive holds all of the
+clips of one recording in a single append-only file instead:
+
+    header    magic, sample rate, and recording name
+    records   one per clip: tag, start index and length in samples, then
+              the clip's 16-bit samples
+    index     start index, length, and file offset of every clip's samples
+    trailer   file offset of the index, and a second magic string
+
+Records are written as clips are detected and the index only when the
+archive is closed. If a run is interrupted before then, ClipArchive
+rebuilds the index by scanning the records, ignoring a partially
+written final record.
+'''
+
+import os
+import struct
+
+import numpy
+
+from audio_file_utils import samples_to_int16
+
+
+ARCHIVE_FILE_NAME_EXTENSION = '.clips'
+
+_HEADER_MAGIC = b'CLPARCH1'
+_TRAILER_MAGIC = b'CLPINDX1'
+_RECORD_TAG = b'CLIP'
+
+_HEADER_FORMAT = '<8sdH'       # magic, sample rate, name length
+_RECORD_FORMAT = '<4sqI'       # tag, start index, length
+_TRAILER_FORMAT = '<q8s'       # index offset, magic
+
+_HEADER_SIZE = struct.calcsize(_HEADER_FORMAT)
+_RECORD_SIZE = struct.calcsize(_RECORD_FORMAT)
+_TRAILER_SIZE = struct.calcsize(_TRAILER_FORMAT)
+
+_SAMPLE_DTYPE = numpy.dtype('<i2')
+_INDEX_DTYPE = numpy.dtype(
+    [('start', '<i8'), ('length', '<u4'), ('offset', '<i8')])
+
+
+class ClipArchiveError(Exception):
+    pass
+
+
+class ClipArchiveWriter:
+    '''
+    Writes clips of one recording to a new clip archive. Use as a
+    context manager, or call close() when done:
+
+        with ClipArchiveWriter(path, 'recording', 22050) as writer:
+            writer.append(start_index, samples)
+
+    Warning: overwrites any file that already exists at `path`
+    '''
+
+    def __init__(self, path, recording_name, sample_rate):
+        self.path = path
+        self._file = open(path, 'wb')
+        self._index = []
+
+        name = recording_name.encode('utf-8')
+        self._file.write(struct.pack(
+            _HEADER_FORMAT, _HEADER_MAGIC, sample_rate, len(name)))
+        self._file.write(name)
+        self._offset = _HEADER_SIZE + len(name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def append(self, start_index, samples):
+        '''Appends a clip that starts at `start_index` in the recording.
+        `samples` is a one-dimensional array as read by audio_file_utils,
+        converted to 16 bits if necessary'''
+
+        samples = numpy.ascontiguousarray(
+            samples_to_int16(samples), dtype=_SAMPLE_DTYPE)
+        length = len(samples)
+
+        self._file.write(struct.pack(
+            _RECORD_FORMAT, _RECORD_TAG, start_index, length))
+        self._file.write(memoryview(samples).cast('B'))
+
+        data_offset = self._offset + _RECORD_SIZE
+        self._index.append((start_index, length, data_offset))
+        self._offset = data_offset + samples.nbytes
+
+    def close(self):
+        '''Writes the index and closes the archive'''
+
+        if self._file.closed:
+            return
+
+        index = numpy.array(self._index, dtype=_INDEX_DTYPE)
+        self._file.write(index.tobytes())
+        self._file.write(struct.pack(
+            _TRAILER_FORMAT, self._offset, _TRAILER_MAGIC))
+        self._file.close()
+
+
+class ClipArchive:
+    '''
+    Reads a clip archive written by ClipArchiveWriter. Clip samples are
+    read from disk only when asked for.
+
+    Attributes:
+        - recording_name, sample_rate: as given to the writer
+        - starts, lengths: arrays of clip start indices and lengths in
+          samples, in the order the clips were written
+    '''
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, 'rb') as file_:
+
+            file_size = os.fstat(file_.fileno()).st_size
+
+            header = file_.read(_HEADER_SIZE)
+            if len(header) < _HEADER_SIZE:
+                raise ClipArchiveError(
+                    "'{}' is too short to be a clip archive".format(path))
+
+            magic, self.sample_rate, name_size = \
+                struct.unpack(_HEADER_FORMAT, header)
+            if magic != _HEADER_MAGIC:
+                raise ClipArchiveError(
+                    "'{}' is not a clip archive".format(path))
+
+            self.recording_name = file_.read(name_size).decode('utf-8')
+            records_offset = _HEADER_SIZE + name_size
+
+            index = self._read_index(file_, records_offset, file_size)
+            if index is None:
+                index = self._scan_records(file_, records_offset, file_size)
+
+        self.starts = index['start']
+        self.lengths = index['length']
+        self._offsets = index['offset']
+
+    def _read_index(self, file_, records_offset, file_size):
+        '''Returns the index written when the archive was closed, or None
+        if there isn't one'''
+
+        if file_size < records_offset + _TRAILER_SIZE:
+            return None
+
+        file_.seek(file_size - _TRAILER_SIZE)
+        index_offset, magic = struct.unpack(
+            _TRAILER_FORMAT, file_.read(_TRAILER_SIZE))
+
+        index_size = file_size - _TRAILER_SIZE - index_offset
+        if magic != _TRAILER_MAGIC or index_offset < records_offset or \
+                index_size % _INDEX_DTYPE.itemsize != 0:
+            return None
+
+        file_.seek(index_offset)
+        return numpy.fromfile(
+            file_, dtype=_INDEX_DTYPE, count=index_size // _INDEX_DTYPE.itemsize)
+
+    def _scan_records(self, file_, records_offset, file_size):
+        '''Rebuilds the index of an archive that was never closed'''
+
+        index = []
+        offset = records_offset
+
+        while offset + _RECORD_SIZE <= file_size:
+
+            file_.seek(offset)
+            tag, start, length = struct.unpack(
+                _RECORD_FORMAT, file_.read(_RECORD_SIZE))
+
+            data_offset = offset + _RECORD_SIZE
+            end = data_offset + length * _SAMPLE_DTYPE.itemsize
+            if tag != _RECORD_TAG or end > file_size:
+                break # partially written record
+
+            index.append((start, length, data_offset))
+            offset = end
+
+        return numpy.array(index, dtype=_INDEX_DTYPE)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def get_clip(self, i):
+        '''Returns the samples of clip `i` as a 16-bit array'''
+        with open(self.path, 'rb') as file_:
+            file_.seek(int(self._offsets[i]))
+            return numpy.fromfile(
+                file_, dtype=_SAMPLE_DTYPE, count=int(self.lengths[i]))
+
+    def __iter__(self):
+        '''Generates (start index, samples) pairs for every clip'''
+        with open(self.path, 'rb') as file_:
+            for start, length, offset in zip(
+                    self.starts.tolist(), self.lengths.tolist(),
+                    self._offsets.tolist()):
+                file_.seek(offset)
+                yield (start, numpy.fromfile(
+                    file_, dtype=_SAMPLE_DTYPE, count=length))
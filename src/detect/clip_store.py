@@ -0,0 +1,135 @@
+'''
+clip_store.py
+
+Detection manifests, and on-demand access to the clips they list.
+
+A manifest is a .csv file with a row for each detection in a run:
+
+    recording_path,start_index,length,sample_rate,settings_name
+    /data/rec1.wav,220500,4205,22050.0,type2
+
+Clips need not be saved as files at all: a ClipStore reads any clip's
+samples straight from its recording when asked for them, through a
+memory-mapped view of the file, so only the samples of the clips that
+are actually looked at are ever read.
+'''
+
+import csv
+import os
+from collections import OrderedDict
+
+from audio_file_utils import read_wave_file_mmap
+from bunch import Bunch
+
+
+_MANIFEST_COLUMNS = (
+    'recording_path', 'start_index', 'length', 'sample_rate', 'settings_name')
+
+# number of recordings a ClipStore keeps mapped at once
+_MAX_OPEN_RECORDINGS = 16
+
+
+class ManifestWriter:
+    '''
+    Writes a detection manifest. Use as a context manager, or call close()
+    when done:
+
+        with ManifestWriter(path) as manifest:
+            manifest.append_detections(recording_path, sample_rate,
+                settings_name, detections)
+
+    Warning: overwrites any file that already exists at `path`
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'w', newline='')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(_MANIFEST_COLUMNS)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def append_detections(self, recording_path, sample_rate, settings_name,
+            detections):
+        '''Adds a row for each (start index, length) pair in `detections`.
+        `settings_name` may be None, for a detector without a name'''
+
+        # absolute, so the manifest can be used from any directory
+        recording_path = os.path.abspath(recording_path)
+        settings_name = settings_name or ''
+
+        self._writer.writerows(
+            (recording_path, start, length, sample_rate, settings_name)
+            for start, length in detections)
+
+    def close(self):
+        self._file.close()
+
+
+def read_manifest(path):
+    '''Returns a list with a Bunch for each row of a detection manifest'''
+
+    with open(path, newline='') as file_:
+        return [
+            Bunch(
+                recording_path=row['recording_path'],
+                start_index=int(row['start_index']),
+                length=int(row['length']),
+                sample_rate=float(row['sample_rate']),
+                settings_name=row['settings_name'] or None)
+            for row in csv.DictReader(file_)]
+
+
+class ClipStore:
+    '''
+    The clips listed in a detection manifest, read from their recordings
+    on demand. Behaves as a sequence of clip Bunches (see read_manifest()):
+
+        store = ClipStore('manifest.csv')
+        for i, clip in enumerate(store):
+            if clip.settings_name == 'type2':
+                samples = store.get_samples(i)
+    '''
+
+    def __init__(self, manifest_path):
+        self.clips = read_manifest(manifest_path)
+
+        # memory-mapped samples of recently used recordings, most recent last
+        self._recordings = OrderedDict()
+
+    def __len__(self):
+        return len(self.clips)
+
+    def __getitem__(self, i):
+        return self.clips[i]
+
+    def __iter__(self):
+        return iter(self.clips)
+
+    def get_samples(self, i):
+        '''
+        Returns the samples of clip `i`, from the channel of its recording
+        that the detector processed. The array returned is a view of the
+        memory-mapped recording: copy it to keep it after the store has
+        moved on to many other recordings
+        '''
+
+        clip = self.clips[i]
+        samples = self._get_recording(clip.recording_path)
+        return samples[0][clip.start_index:clip.start_index + clip.length]
+
+    def _get_recording(self, path):
+
+        samples = self._recordings.pop(path, None)
+
+        if samples is None:
+            samples, _ = read_wave_file_mmap(path)
+            if len(self._recordings) == _MAX_OPEN_RECORDINGS:
+                self._recordings.popitem(last=False)
+
+        self._recordings[path] = samples
+        return samples
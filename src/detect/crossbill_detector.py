@@ -7,16 +7,48 @@ Wrapper for Harold Mill's reimplementation of the Old Bird NFC detectors.
 Usage: 
 $ python crossbill_detector.py -f <filename.wav>
 $ python crossbill_detector.py -d <directory-of-wav-files/>
+$ python crossbill_detector.py -d <directory-of-wav-files/> -j <number-of-processes>
+$ python crossbill_detector.py -d <directory-of-wav-files/> --clips archive
+$ python crossbill_detector.py --export-archive <recording.clips>
+$ python crossbill_detector.py -d <directory-of-wav-files/> --clips none --manifest <manifest.csv>
+$ python crossbill_detector.py -d <directory-of-wav-files/> --ledger <ledger.sqlite> --force
+$ python crossbill_detector.py -d <directory-of-wav-files/> --include '2018-*/*.wav' --exclude '*/test/*'
+$ find /recordings -name '*.wav' | python crossbill_detector.py --file-list -
+$ python crossbill_detector.py -f <long-recording.wav> --segments <number-of-processes>
 '''
 
-# Harold Mills's utilities (my modifications: CrossbillDetector & OpenDetector)
-from old_bird_detector_redux_1_1 import CrossbillDetector, OpenDetector
-from audio_file_utils import read_wave_file, write_wave_file
+# Harold Mills's utilities (my modifications: get_crossbill_settings & MultiDetector)
+from old_bird_detector_redux_1_1 import (
+    get_crossbill_settings, get_filter_cache_dir, get_segment_crossings, 
+    MultiDetector, set_filter_cache_dir)
+from audio_file_utils import (
+    read_wave_file_blocks, read_wave_file_mmap, samples_to_int16,
+    write_wave_file)
 from bunch import Bunch 
 
+# Own module for saving all of a recording's detections in one file
+from clip_archive import (
+    ClipArchive, ClipArchiveWriter, ARCHIVE_FILE_NAME_EXTENSION)
+
+# Own module for listing detections in a manifest, so that clips can be
+# read from their recordings later (see clip_store.ClipStore)
+from clip_store import ManifestWriter
+
+# Own module for skipping files processed by earlier runs
+from ledger import Ledger, get_file_stamp, settings_fingerprint
+
+# Own module for the directories each run saves its output in, and the
+# names of clip files
+from output_layout import OutputLayout, clip_file_name
+
+# Own module for finding the files to process, and ordering them
+from file_discovery import (
+    DEFAULT_INCLUDE, find_files, get_recording_names, order_longest_first,
+    read_file_list)
+
 # Various ops related to reading in samples and saving detections
-from os import makedirs, listdir
-from shutil import rmtree
+from os import makedirs, path
+import sys
 import numpy # write_wave_file takes detections in the form of an nparray
 from ntpath import basename # for finding filename within path
 
@@ -24,76 +56,64 @@ from ntpath import basename # for finding filename within path
 from plotter import frequency_bar_plotter
 
 # For validating files/directories and using command line arguments
-from argument_parser import is_directory, is_wav_file, input_validation
+from argument_parser import input_validation
 
 # For levels of verbosity in error logging
 import logging
 
+# For running the detector on many files at once
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+# For writing clip files in the background
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore
+
 repo_path = 'C:/Users/tessa/drive/red-crossbills/crossbill-detect'
 
 ### Class for direct interaction with detector objects
 class _Listener:
     '''A listener that interacts with the Old Bird Detector Redux (OBDR).
     Methods include:
-        - extract_single_channel(): put samples in correct format for the OBDR
         - append_detection(): called for every detection found by the OBDR
         - detections_to_files(): save all detections as .wav files
+        - detections_to_archive(): save all detections in one clip archive
         - average_length: calculate average length of detections
     '''
     
-    def __init__(self, source_file, samples, sample_rate):
+    def __init__(self, samples, sample_rate):
+        '''`samples` is the single channel of samples given to the OBDR, 
+        as returned by extract_single_channel()'''
         self.sample_rate = sample_rate
-        self.samples = self.extract_single_channel(source_file, samples)
+        self.samples = samples
         self.detections = [] #to be filled in by append_detections()
+        self.pending = [] #clip files being written by a _ClipWriter
       
       
     def append_detection(self, start_index, length):
         '''Called for every clip found by Old Bird detector'''
         self.detections.append((start_index, length))
      
-     
-    def extract_single_channel(self, source_path, samples):
-        '''
-        Returns the first subarray from `samples`, a two-dimensional array of 
-        channels of sound read from a .wav file. The array returned is in the 
-        format required by the OBDR.
-        '''
-        
-        filename = basename(source_path)
-        
-        if len(samples) > 1:
-            if len(samples) == 2: 
-                if samples[0].all() == samples[1].all():
-                    warn_str = "File '{}' contains two identical channels as read".format(filename)
-              
-                else:
-                    warn_str = "File '{}' contains two non-identical channels as read".format(filename)
-            else:
-                warn_str = "Multiple channels in file '{}' as read".format(filename)
-            
-            logging.warning(warn_str)
-            logging.info("Processing first channel")
-            return samples[0]
-            
-        elif len(samples) == 1:
-            logging.info("Processing single channel in file '{}'".format(filename))
-            return samples[0]
-            
-        else:
-            logging.info("File {} is empty".format(filename))
-            return []
     
 
-    def detections_to_files(self, dir_name, recording_name):
+    def detections_to_files(self, layout, detector_name, recording_name,
+        mono = False, writer = None):
         '''
         Uses write_wave_file() from Vesper's audio_file_utils to write a mono
         audio file given their start time and length in samples.
+        
+        The files are saved in the directory of the detector named
+        detector_name in `layout`, an OutputLayout.
+        
+        If mono is False, each file has two identical channels, as before.
+        If a _ClipWriter is given, the files are written in the background
+        and the writes pending are listed in self.pending.
         '''
         
         lengths = []
         logging.info("Saving files from {}.wav".format(recording_name))
         
-        # write detections to `dir_name/`
+        # write detections to the detector's directory
         for detection in self.detections:
             (start, length) = detection
             
@@ -104,19 +124,43 @@ class _Listener:
             #   logging.info(length)
             #   continue
             
-            # create filename indicating detection origin and start in ms
-            start_sec = int(1000 * start/self.sample_rate)
-            filename = "{}/{}_{}ms.wav".format(dir_name, 
-                       recording_name, start_sec)
+            filename = layout.get_file_path(detector_name, 
+                clip_file_name(recording_name, start, self.sample_rate))
             
-            # create numpy array of detections (mono file)
-            clip = numpy.array([self.samples[start:start+length], self.samples[start:start+length]], numpy.int32)
+            # a slice of the source samples, so no samples are copied here
+            clip = self.samples[start:start+length]
             
-            # warning: will overwrite any clips that already exist
-            write_wave_file(filename, clip, self.sample_rate)
-            logging.info("{} saved".format(filename))
+            if writer:
+                self.pending.append(writer.submit(filename, clip, 
+                    self.sample_rate, mono))
+            else:
+                write_clip_file(filename, clip, self.sample_rate, mono)
             
         return lengths
+    
+    
+    def detections_to_archive(self, layout, detector_name, recording_name):
+        '''
+        Writes all detections to a single clip archive, `recording_name.clips`
+        in the directory of the detector named detector_name in `layout`,
+        rather than to a file apiece. Individual .wav files can be exported 
+        from the archive later with export_archive().
+        Returns the lengths of the detections and the archive's path.
+        '''
+        
+        lengths = []
+        archive_path = layout.get_file_path(detector_name, 
+            recording_name + ARCHIVE_FILE_NAME_EXTENSION)
+        logging.info("Saving clips from {}.wav to '{}'".format(
+            recording_name, archive_path))
+        
+        with ClipArchiveWriter(archive_path, recording_name, 
+                self.sample_rate) as writer:
+            for (start, length) in self.detections:
+                writer.append(start, self.samples[start:start+length])
+                lengths.append(length)
+                
+        return lengths, archive_path
      
     
     def average_length(self):
@@ -146,78 +190,582 @@ class _Listener:
     
 ### Miscellaneous and wrapper functions
 
-def make_dir(dir_name, mode):
-    ''' 
-    Creates a directory if it doesn't already exist. 
-    If directory does exist:
-        - if mode is 0, function doesn't delete previous directory or make a new directory
-        - if mode is 1, function recursively deletes everything in preexisting directory
-        - if mode is 2, function makes a new directory with a number appended to it
-    '''
-    
-    if not is_directory(dir_name):
-        logging.info("Making directory '{}/'".format(dir_name))
-        makedirs(dir_name)
-    elif mode == 0:
-        logging.warning("Warning: '{}/' already exists; some contents may be overwritten".format(dir_name))
-    elif mode == 1:
-        logging.warning("Warning: deleting preexisting directory '{}'/".format(dir_name))
-        rmtree(dir_name)
-    else: #mode == 2
-        increment = 2
-        new_name = dir_name + str(increment)
-        while is_directory(new_name):
-            increment += 1
-            new_name = dir_name + '-' + str(increment)
-        dir_name = new_name
-        logging.info("Making directory '{}/'".format(dir_name))
-        makedirs(dir_name)
+# Number of samples compared by extract_single_channel()
+_CHANNEL_COMPARISON_LENGTH = 1000000
+
+# Number of samples passed to the detector at a time
+BLOCK_SIZE = 1000000
+
+def write_clip_file(filename, clip, sample_rate, mono = False):
+    '''Writes the one-dimensional array of samples `clip` to a 16-bit .wav
+    file, either as a mono file or with the clip duplicated in two channels'''
+    
+    # 16-bit clips (the clips of 16-bit recordings) are not copied
+    clip = samples_to_int16(clip)
+    
+    if mono:
+        channels = clip[numpy.newaxis]
+    else:
+        # two channels that are views of the same samples, interleaved
+        # only as they are written
+        channels = numpy.broadcast_to(clip, (2, len(clip)))
+    
+    # warning: will overwrite any clips that already exist
+    write_wave_file(filename, channels, sample_rate)
+    logging.info("{} saved".format(filename))
+
+
+class _ClipWriter:
+    '''
+    Writes clip files on a pool of background threads, so that detection
+    can go on while files are written. At most max_pending files wait to
+    be written at once: submit() blocks when that many are waiting, so 
+    that the clips waiting are bounded in number.
+    
+    Use as a context manager, which waits for all files to be written 
+    when it exits.
+    '''
+    
+    def __init__(self, num_threads = 4, max_pending = 256):
+        self._executor = ThreadPoolExecutor(num_threads)
+        self._slots = BoundedSemaphore(max_pending)
+        
+    def __enter__(self):
+        return self
+        
+    def __exit__(self, *args):
+        self._executor.shutdown()
+        
+    def submit(self, filename, clip, sample_rate, mono = False):
+        '''Queues a clip to be written with write_clip_file(). Returns
+        a Future for the write'''
+        self._slots.acquire()
+        future = self._executor.submit(write_clip_file, filename, clip,
+            sample_rate, mono)
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+    
+
+def export_archive(archive_path, dir_name = None, mono = False):
+    '''
+    Writes each clip in a clip archive (see detections_to_archive()) to its
+    own .wav file, named as by detections_to_files(). The files are saved
+    in dir_name, by default a directory named after the archive next to it.
+    Returns the name of the directory.
+    '''
     
+    archive = ClipArchive(archive_path)
+    
+    if dir_name is None:
+        dir_name = archive_path[:-len(ARCHIVE_FILE_NAME_EXTENSION)]
+    makedirs(dir_name, exist_ok=True)
+        
+    for start, clip in archive:
+        filename = path.join(dir_name, clip_file_name(archive.recording_name,
+            start, archive.sample_rate))
+        write_clip_file(filename, clip, archive.sample_rate, mono)
+        
     return dir_name
 
-def detect_from_file(file_path, settings = None):
+
+def extract_single_channel(source_path, samples):
+    '''
+    Returns the first subarray from `samples`, a two-dimensional array of 
+    channels of sound read from a .wav file. The array returned is in the 
+    format required by the OBDR.
     '''
     
-    Creates a detector object to detect crossbill calls of a desired type. 
-    Makes a new directory, then saves these detections using detections_to_files
+    filename = basename(source_path)
     
-    If settings are provided, creates an "OpenDetector" which allows
-    the user to call the detector with their own settings. Otherwise, creates CrossbillDetector.
+    if len(samples) > 1:
+        if len(samples) == 2: 
+            # Compare only the start of the channels, so long files are not
+            # read in full just for this warning
+            n = _CHANNEL_COMPARISON_LENGTH
+            if numpy.array_equal(samples[0][:n], samples[1][:n]):
+                warn_str = "File '{}' contains two identical channels as read".format(filename)
+          
+            else:
+                warn_str = "File '{}' contains two non-identical channels as read".format(filename)
+        else:
+            warn_str = "Multiple channels in file '{}' as read".format(filename)
+        
+        logging.warning(warn_str)
+        logging.info("Processing first channel")
+        return samples[0]
+        
+    elif len(samples) == 1:
+        logging.info("Processing single channel in file '{}'".format(filename))
+        return samples[0]
+        
+    else:
+        logging.info("File {} is empty".format(filename))
+        return []
+
+
+def get_detector_settings(settings = None, types = None):
+    '''
+    Returns a list of (name, settings) pairs, one for each detector to run.
+    
+    `settings` may be a settings Bunch with a `name` attribute, or a list
+    of such Bunches. If no settings are provided, crossbill settings are 
+    used for each call type in `types`, named "type2", "type6", etc. With 
+    neither settings nor types, a single type 2 detector named None is used.
+    '''
+    
+    if settings:
+        if isinstance(settings, Bunch):
+            settings = [settings]
+        return [(s.name, s) for s in settings]
+    
+    elif types:
+        return [("type{}".format(t), get_crossbill_settings(t)) for t in types]
+    
+    else:
+        return [(None, get_crossbill_settings(2))]
+
+def detect_from_file(file_path, settings = None, types = None, decimate = False,
+    dtype = 'float64', clips = 'wav', mono = False, writer = None, 
+    layout = None, segment_jobs = 1, recording_name = None):
+    '''
+    
+    Creates a detector object to detect crossbill calls of the desired types. 
+    Saves its detections in the detector's directory of `layout`, an 
+    OutputLayout, using detections_to_files, or detections_to_archive if 
+    clips is 'archive'. If no layout is given, a new run directory is made 
+    in repo_path. If clips is 'none', no clips are saved: the detections 
+    can be listed in a manifest instead (see main())
+    
+    If settings are provided, detects with the user's own settings instead.
+    All detectors run in a single pass over the file, sharing any 
+    processing their settings have in common (see get_detector_settings())
+    
+    If decimate is True, each detector processes the file at the lowest 
+    sample rate its settings allow, which is much faster for files 
+    recorded at high sample rates
+    
+    dtype is the floating point type samples are processed in. 'float32'
+    uses about half the memory of the default 'float64' and is faster.
+    Integration is still done in 'float64', so loud sounds don't swamp
+    the quiet ones that follow them, and the detections are normally the
+    same, though one may rarely move by a sample or so
+    
+    If segment_jobs is more than 1, the file is split into that many 
+    segments, which are processed in parallel worker processes (see 
+    _detect_in_segments()). The detections are exactly the same
+    
+    Clip files and archives are named after recording_name, by default the
+    file's name without its extension (see file_discovery.get_recording_names()
+    for naming recordings with the same file name apart)
+    
+    If mono is True, .wav files are mono rather than two identical channels.
+    If a _ClipWriter is given, .wav files are written in the background:
+    call _wait_for_clips() on the results before using the files
+    
+    Returns a list with a Bunch for each detector, holding its name, the
+    directory its detections were saved in (None if they weren't), the path 
+    of the clip archive they were saved in (None for .wav files), the 
+    recording's path and sample rate, its detections as (start index, 
+    length) pairs, the lengths of the detections in samples, and Futures 
+    for any files still being written
     '''
     
     # Generate a two-dimensional numpy array frome wave file
     # nparray is of shape (num_channels, num_samples)
-    (samples, sample_rate) = read_wave_file(file_path)
+    # The array is memory-mapped, so samples are read from disk as needed
+    # rather than all at once
+    (samples, sample_rate) = read_wave_file_mmap(file_path)
+    
+    channel = extract_single_channel(file_path, samples)
     
-    # This function will be notified by the detector
-    listener = _Listener(file_path, samples, sample_rate)
+    # Each detector notifies its own listener
+    named_settings = get_detector_settings(settings, types)
+    
+    if layout is None and clips != 'none':
+        layout = OutputLayout(repo_path, [name for name, _ in named_settings])
+    listeners = [_Listener(channel, sample_rate) for _ in named_settings]
     
     # Run detection pipeline
-    if settings:
-        detector = OpenDetector(sample_rate, listener, settings)
+    detector = MultiDetector(
+        [s for _, s in named_settings], sample_rate, listeners, decimate,
+        dtype)
+        
+    if segment_jobs > 1 and len(channel) > BLOCK_SIZE:
+        _detect_in_segments(detector, file_path, 
+            [s for _, s in named_settings], len(channel), segment_jobs,
+            decimate, dtype)
+    
     else:
-        type = 2
-        detector = CrossbillDetector(sample_rate, listener, type)
+        # Stream the first channel through the detector one block at a time,
+        # so the detector never holds more than a block of samples
+        for _, block in read_wave_file_blocks(file_path, channel_num=0,
+                block_size=BLOCK_SIZE):
+            detector.detect(block)
         
-    detector.detect(listener.samples)
     detector.complete_detection()
 
     # Find average length of clips
     #average_length(listener.clips, sample_rate)
     
-    # Make a "detections/" dir or similar if it doesn't already exist
-    if settings: preferred_name = repo_path+"/detections-"+settings.name
-    else: preferred_name = repo_path+"/detections"
-    # Option 2: add number to directory name if preferred dir already exists
-    dir_name = make_dir(preferred_name, 2) 
+    if recording_name is None:
+        recording_name = basename(file_path).replace('.wav','')
+    results = []
+    
+    for (name, _), listener in zip(named_settings, listeners):
+    
+        if clips == 'none':
+            results.append(Bunch(name=name, dir_name=None, archive_path=None,
+                recording_path=file_path, sample_rate=sample_rate,
+                detections=listener.detections,
+                lengths=[length for _, length in listener.detections],
+                pending=[]))
+            continue
+    
+        # Made with the layout, e.g. "detections-type2/", with its shards
+        # made as clips are saved in them
+        dir_name = layout.get_detector_dir(name)
+        
+        # Create files in the directory and return lengths of files in samples
+        if clips == 'archive':
+            lengths, archive_path = listener.detections_to_archive(
+                layout, name, recording_name)
+        else:
+            lengths = listener.detections_to_files(layout, name, 
+                recording_name, mono, writer)
+            archive_path = None
+        
+        #frequency_bar_plotter(lengths)
+        results.append(Bunch(name=name, dir_name=dir_name, 
+            archive_path=archive_path, recording_path=file_path, 
+            sample_rate=sample_rate, detections=listener.detections,
+            lengths=lengths, pending=listener.pending))
+        
+    return results
+
+
+def _detect_in_segments(detector, file_path, settings, length, jobs, 
+    decimate, dtype):
+    '''
+    Runs `detector`, a MultiDetector with the given settings, on the first
+    channel of a file of `length` samples, using a pool of `jobs` worker 
+    processes. 
+    
+    The file is split into consecutive segments of whole blocks, one per
+    worker. Each worker finds the detectors' threshold crossings in its 
+    segment, starting from the two blocks before the segment so that its
+    detectors are in the same state as when processing the whole file (see
+    get_segment_crossings()). The detector then finds clips in the 
+    crossings of each segment in turn, so that clips spanning segments are
+    found just as when processing the whole file.
+    
+    Workers use the same filter cache directory as this process, if any.
+    '''
+    
+    bounds = get_segment_bounds(length, jobs)
+    num_segments = len(bounds) - 1
+    
+    level = logging.getLogger().getEffectiveLevel()
+    with ProcessPoolExecutor(num_segments, initializer=_init_worker,
+            initargs=(level, get_filter_cache_dir())) as executor:
+        for segment_crossings in executor.map(
+                partial(_get_segment_crossings, file_path, settings,
+                    decimate=decimate, dtype=dtype),
+                bounds[:-1], bounds[1:]):
+            detector.process_segment_crossings(segment_crossings)
+        
+        
+def get_segment_bounds(length, num_segments, block_size = BLOCK_SIZE):
+    '''Returns the indices at which a recording of `length` samples is
+    split into at most num_segments segments of whole blocks of 
+    block_size samples, for detecting in segments, followed by `length`'''
+    num_blocks = -(-length // block_size)
+    num_segments = max(min(num_segments, num_blocks), 1)
+    return [block_size * (num_blocks * i // num_segments) 
+            for i in range(num_segments)] + [length]
+        
+        
+def _get_segment_crossings(file_path, settings, start_index, end_index,
+    decimate, dtype):
+    '''Finds threshold crossings in one segment of the first channel of a 
+    file, in a worker process (see _detect_in_segments())'''
+    (samples, sample_rate) = read_wave_file_mmap(file_path)
+    return get_segment_crossings(settings, sample_rate, samples[0], 
+        start_index, end_index, BLOCK_SIZE, decimate, dtype)
+
+
+### Running the detector on many files
+
+class _LogRecorder(logging.Handler):
+    '''Logging handler that keeps (level, message) pairs in a list, 
+    so that worker processes can send their log output back to main()'''
+    
+    def __init__(self):
+        super().__init__()
+        self.records = []
+        
+    def emit(self, record):
+        self.records.append((record.levelno, self.format(record)))
+
+
+def _init_worker(level, filter_cache_dir):
+    '''Sets up logging and the filter cache in a worker process. Log output
+    is only recorded (see _detect_in_worker()), so any handlers inherited 
+    from the main process are removed'''
+    logger = logging.getLogger()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.setLevel(level)
+    set_filter_cache_dir(filter_cache_dir)
+
+
+def _try_detect_from_file(file_path, **kwargs):
+    '''
+    Runs detect_from_file() on one file, passing it any keyword arguments.
+    Returns a Bunch holding the file
+    path, the results of detect_from_file() (an empty list if it failed),
+    an error message or None, and the recorded log output (see 
+    _detect_in_worker())
+    '''
+    
+    try:
+        results = detect_from_file(file_path, **kwargs)
+        error = None
+    except Exception as e:
+        results = []
+        error = "{}: {}".format(type(e).__name__, e)
+        
+    return Bunch(file_path=file_path, results=results, error=error, log=[])
+
+
+def _wait_for_clips(file_report):
+    '''Waits for the clip files of a file report to be written, recording
+    the first error in writing them, if any. Returns the report'''
+    
+    for result in file_report.results:
+        for future in result.pending:
+            e = future.exception()
+            if e is not None and not file_report.error:
+                file_report.error = "{}: {}".format(type(e).__name__, e)
+        result.pending = []
+        
+    return file_report
+
+
+def _detect_in_worker(file_path, recording_name, **kwargs):
+    '''Runs _try_detect_from_file() in a worker process, recording the
+    log output produced while processing the file so that main() can 
+    report it in order'''
+    
+    recorder = _LogRecorder()
+    logger = logging.getLogger()
+    logger.addHandler(recorder)
+    
+    # Other worker processes keep detecting while this one writes files
+    try:
+        with _ClipWriter() as writer:
+            file_report = _try_detect_from_file(file_path, writer=writer,
+                recording_name=recording_name, **kwargs)
+        _wait_for_clips(file_report)
+    finally:
+        logger.removeHandler(recorder)
+        
+    file_report.log = recorder.records
+    return file_report
+
+
+def detect_from_files(file_paths, jobs = 1, filter_cache_dir = None, 
+    recording_names = None, **kwargs):
+    '''
+    Runs detect_from_file() on each of file_paths with the given keyword 
+    arguments, using a pool of `jobs` worker processes if `jobs` is more
+    than 1. Designed detector filters are cached in filter_cache_dir, if
+    given, as well as in memory. Outputs are named after the names in the 
+    dictionary recording_names, by path, if given (see 
+    file_discovery.get_recording_names()).
     
-    # Create files in new directory and return lengths of files in samples
-    recording_name = basename(file_path).replace('.wav','')
-    lengths = listener.detections_to_files(dir_name, recording_name)
+    Yields a Bunch for each file (see _try_detect_from_file()) in the order
+    of file_paths, whatever order the files finish in, once its clip files
+    have been written. Errors in one file do not stop the others from being
+    processed.
     
-    #  Print final information
-    #frequency_bar_plotter(lengths)
-    print("Files saved in '{}/'".format(dir_name))
+    Without a pool, the clip files of one file are written in the 
+    background while the next file is processed.
+    '''
+    
+    recording_names = recording_names or {}
+    
+    if jobs > 1:
+        level = logging.getLogger().getEffectiveLevel()
+        with ProcessPoolExecutor(jobs, initializer=_init_worker,
+                initargs=(level, filter_cache_dir)) as executor:
+            yield from executor.map(
+                partial(_detect_in_worker, **kwargs), file_paths,
+                [recording_names.get(file_path) for file_path in file_paths])
+    else:
+        set_filter_cache_dir(filter_cache_dir)
+        with _ClipWriter() as writer:
+            previous_report = None
+            for file_path in file_paths:
+                file_report = _try_detect_from_file(file_path, writer=writer,
+                    recording_name=recording_names.get(file_path), **kwargs)
+                if previous_report:
+                    yield _wait_for_clips(previous_report)
+                previous_report = file_report
+            if previous_report:
+                yield _wait_for_clips(previous_report)
+
+
+def _report(file_report):
+    '''Replays a file's log output and prints where its detections were saved'''
+    
+    for level, message in file_report.log:
+        logging.log(level, message)
+        
+    if file_report.error:
+        logging.error("Failed to process '{}': {}".format(
+            file_report.file_path, file_report.error))
+        
+    for result in file_report.results:
+        _print_result(result)
+
+
+def _print_result(result):
+    '''Prints where a detector's detections were saved, if they were'''
+    if result.archive_path:
+        print("Clips saved in '{}'".format(result.archive_path))
+    elif result.dir_name:
+        print("Files saved in '{}/'".format(result.dir_name))
+
+
+def _add_to_manifest(manifest, results):
+    '''Lists the detections in results from detect_from_file() in a
+    clip_store.ManifestWriter'''
+    for result in results:
+        manifest.append_detections(result.recording_path, 
+            result.sample_rate, result.name, result.detections)
+
+
+def _summarize(file_reports, num_skipped = 0):
+    '''Prints detection counts and mean lengths over all processed files,
+    and the number of files skipped as already processed'''
+    
+    num_failed = 0
+    lengths = []
+    
+    for file_report in file_reports:
+        if file_report.error:
+            num_failed += 1
+        for result in file_report.results:
+            lengths.extend(result.lengths)
+    
+    mean_length = sum(lengths) / len(lengths) if lengths else 0
+    
+    print("Processed {} files ({} failed): {} detections, mean length {:.0f} samples".format(
+        len(file_reports), num_failed, len(lengths), mean_length))
+    
+    if num_skipped:
+        print("Skipped {} files already processed with the same settings (use --force to reprocess)".format(
+            num_skipped))
+
+
+def _get_fingerprint(options):
+    '''Returns the ledger fingerprint of the options for detect_from_file()
+    that affect a file's detections and how they are saved'''
+    return settings_fingerprint(
+        get_detector_settings(options.get('settings'), options.get('types')),
+        options.get('decimate'), options.get('dtype'), options.get('clips'),
+        options.get('mono'))
+
+
+def _ledger_results(file_path, processed):
+    '''Returns results like those of detect_from_file() for a file's
+    detections as recorded in the ledger, with nothing left to save'''
+    return [Bunch(name=name, dir_name=None, archive_path=None,
+                recording_path=file_path, sample_rate=processed.sample_rate,
+                detections=detections,
+                lengths=[length for _, length in detections], pending=[])
+            for name, detections in processed.detections]
+
+
+def _detect_in_file(input, options, manifest):
+    '''Detects calls within the file the user provided'''
+    
+    set_filter_cache_dir(input['filter_cache'])
+    results = detect_from_file(input['file'], **options)
+    _add_to_manifest(manifest, results)
+    for result in results:
+        _print_result(result)
+        
+
+def _get_file_paths(input):
+    '''Returns the paths of the files to detect calls within: the files 
+    in the directory tree the user provided that match the include and
+    exclude patterns, or the files in the file list the user provided'''
+    
+    if input['dir']:
+        return list(find_files(input['dir'], 
+            input['include'] or DEFAULT_INCLUDE, input['exclude'] or ()))
+        
+    elif input['file_list'] == '-':
+        return read_file_list(sys.stdin)
+    
+    else:
+        with open(input['file_list']) as file_:
+            return read_file_list(file_)
+
+
+def _detect_in_dir(input, options, manifest):
+    '''Detects calls within all files in the directory tree or file list
+    the user provided'''
+    
+    # Start with the longest files, so that when processing files in 
+    # parallel, the run doesn't end with one long file processed alone
+    file_paths = order_longest_first(_get_file_paths(input))
+    logging.info("Found {} files to process".format(len(file_paths)))
+    
+    # Recordings with the same file name in different directories are
+    # named apart, so that their clips don't overwrite each other
+    recording_names = get_recording_names(file_paths)
+            
+    # Files already processed with the same settings are skipped, though
+    # their detections are still listed in the manifest
+    ledger_path = input['ledger'] or repo_path + "/ledger.sqlite"
+    makedirs(path.dirname(path.abspath(ledger_path)), exist_ok=True)
+    fingerprint = _get_fingerprint(options)
+    
+    with Ledger(ledger_path) as ledger:
+    
+        unprocessed_paths = []
+        file_stamps = {}
+        num_skipped = 0
+        
+        for file_path in file_paths:
+            processed = None if input['force'] else \
+                ledger.get_detections(file_path, fingerprint)
+            if processed:
+                logging.info("Skipping '{}': already processed".format(file_path))
+                _add_to_manifest(manifest, _ledger_results(file_path, processed))
+                num_skipped += 1
+            else:
+                file_stamps[file_path] = get_file_stamp(file_path)
+                unprocessed_paths.append(file_path)
+        
+        file_reports = []
+        for file_report in detect_from_files(unprocessed_paths, input['jobs'],
+                input['filter_cache'], recording_names, **options):
+            _report(file_report)
+            _add_to_manifest(manifest, file_report.results)
+            file_reports.append(file_report)
+            
+            # Only files whose detections were all saved count as processed
+            if not file_report.error:
+                results = file_report.results
+                ledger.record(file_report.file_path, fingerprint,
+                    results[0].sample_rate,
+                    [(result.name, result.detections) for result in results],
+                    file_stamps[file_report.file_path])
+        
+    _summarize(file_reports, num_skipped)
 
 
 def main():
@@ -229,25 +777,44 @@ def main():
     else:
         logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.WARNING)
     
-    # If user provided a file, detect calls within it
-    if input['file']:
-        detect_from_file(input['file'])
+    # Options for detect_from_file()
+    options = dict(types=input['type'], decimate=input['decimate'],
+        dtype=input['dtype'], clips=input['clips'], mono=input['mono'],
+        segment_jobs=input['segments'])
+    
+    # Worker processes can't start processes of their own
+    if input['jobs'] > 1 and input['segments'] > 1:
+        logging.warning("Ignoring --segments, since files are processed in parallel with -j")
+        options['segment_jobs'] = 1
+    
+    # If user provided a clip archive, export its clips as .wav files
+    if input['export_archive']:
+        dir_name = export_archive(input['export_archive'], mono=input['mono'])
+        print("Files saved in '{}/'".format(dir_name))
         return
     
-    # If user provided a directory, detect calls within all files in directory
-    elif input['dir']:
-        directory = input['dir']
-        
-        # Run detector on every file ending with .wav in directory
-        for filename in listdir(directory):
-        
-            file_path = directory + filename
-            if is_wav_file(file_path): # function from parser.py
-                detect_from_file(file_path)
-            else:
-                logging.warning("Skipping '{}': not a .wav file".format(file_path))
+    if not (input['file'] or input['dir'] or input['file_list']):
+        print("Please specify a file with -f, a directory with -d, or a file list with --file-list. For help use flag -h")
+        return
     
-    else:
-        print("Please specify a file with -f or a directory with -d. For help use flag -h")   
+    # Every run saves its output in a new run directory, with a directory
+    # for each detector made once, here, rather than for every file
+    detector_names = [name for name, _ in get_detector_settings(None, input['type'])]
+    layout = OutputLayout(repo_path,
+        detector_names if input['clips'] != 'none' else [])
+    options['layout'] = layout
+    
+    # Every run lists its detections in a manifest
+    manifest_path = input['manifest'] or layout.manifest_path
+    
+    with ManifestWriter(manifest_path) as manifest:
+        if input['file']:
+            _detect_in_file(input, options, manifest)
+        else:
+            _detect_in_dir(input, options, manifest)
+            
+    print("Detections listed in '{}'".format(manifest_path))
 
-main()
+# Worker processes import this module, so only run main() from the command line
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,392 @@
+'''
+export_spectrograms.py
+
+Saves a spectrogram image of every clip in a directory of detections or
+a detection manifest, for reviewing detections in bulk.
+
+Usage:
+$ python export_spectrograms.py <detections-directory/>
+$ python export_spectrograms.py <manifest.csv> -o <output-directory/> -j <number-of-processes>
+$ python export_spectrograms.py <manifest.csv> --renderer matplotlib --size 100 100
+$ python export_spectrograms.py <detections-directory/> --cache
+
+The clips of a directory, such as a detector directory of a run, are
+the .wav files in its tree, and their images are saved in a tree of the
+same shape. The clips of a manifest are read from their recordings (see
+clip_store.ClipStore), and their images are saved in a new run directory
+of the output directory, sharded like clip files (see output_layout.py).
+
+Clips are sent to worker processes in chunks. Each worker computes the
+spectrograms of a chunk's clips in batches (see spectrogram_stft.py) and
+saves them with a single renderer that it keeps for all of its chunks:
+by default the direct .png renderer of spectrogram_png.py, or a single
+matplotlib Figure drawn on the Agg backend. With --cache, spectrograms
+are taken from the spectrogram cache shared with the review application
+when they are there, and cached when they are not (see
+spectrogram_cache.py).
+'''
+
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from audio_file_utils import read_wave_file
+from clip_store import ClipStore, read_manifest
+from file_discovery import find_files, get_recording_names
+from output_layout import OutputLayout, clip_file_name
+from spectrogram_cache import get_key, SpectrogramCache, DEFAULT_CACHE_DIR
+from spectrogram_png import spectrogram_to_image, write_png
+from spectrogram_stft import (
+    compute_spectrograms, group_by_length, DEFAULT_SETTINGS)
+
+
+# Number of clips sent to a worker process at a time
+_CHUNK_SIZE = 256
+
+# Settings of a worker process, set by _init_worker()
+_worker = None
+
+
+class _PngRenderer:
+    '''Saves spectrograms with spectrogram_png'''
+
+    def __init__(self, size):
+        self._size = size
+
+    def save(self, spectrum, limits, path):
+        (vmin, vmax) = limits
+        write_png(path, 
+            spectrogram_to_image(spectrum, vmin, vmax, size=self._size))
+
+
+class _MatplotlibRenderer:
+    '''
+    Saves spectrograms with matplotlib, drawing each in the same image
+    of the same Figure, so that the Figure is made only once.
+    '''
+
+    def __init__(self, size):
+
+        # Imported here, so only workers that use matplotlib import it
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        (width, height) = size
+        self._figure = Figure(figsize=(width / 100, height / 100), dpi=100)
+        FigureCanvasAgg(self._figure)
+
+        # Axes that fill the figure, with an image that fills the axes
+        self._axes = self._figure.add_axes((0, 0, 1, 1))
+        self._axes.set_axis_off()
+        self._image = None
+
+    def save(self, spectrum, limits, path):
+
+        # Flipped so that the highest frequency is at the top, as by specgram()
+        spectrum = spectrum[::-1]
+
+        if self._image is None:
+            self._image = self._axes.imshow(spectrum, cmap='gray_r',
+                aspect='auto', interpolation='nearest', extent=(0, 1, 0, 1))
+        else:
+            self._image.set_data(spectrum)
+
+        # Scaled to the whole spectrum, as by specgram() (see
+        # spectrogram_stft.compute_spectrograms())
+        if np.all(np.isfinite(limits)):
+            self._image.set_clim(*limits)
+
+        self._figure.savefig(path, dpi=100)
+
+
+_RENDERERS = {'png': _PngRenderer, 'matplotlib': _MatplotlibRenderer}
+
+
+def _init_worker(manifest_path, settings, renderer, size, cache_dir):
+    '''Sets up a worker process to read clips from the manifest at
+    manifest_path, or from .wav files if it is None, and save their
+    spectrograms with the given settings and renderer, using the
+    spectrogram cache in cache_dir if it is not None'''
+
+    global _worker
+
+    store = ClipStore(manifest_path) if manifest_path else None
+    cache = SpectrogramCache(cache_dir) if cache_dir else None
+
+    _worker = dict(
+        store=store, settings=settings, cache=cache,
+        renderer=_RENDERERS[renderer](size))
+
+
+def _read_clip(source):
+    '''Returns the samples and sample rate of a clip, given its index in
+    the worker's manifest or the path of its .wav file'''
+
+    store = _worker['store']
+
+    if store is not None:
+        return (store.get_samples(source), store[source].sample_rate)
+
+    (samples, sample_rate) = read_wave_file(source)
+    return (samples[0], sample_rate)
+
+
+def _export_chunk(chunk):
+    '''
+    Saves the spectrogram of each clip in a chunk, a list of (clip
+    source, image path) pairs (see _read_clip()). Returns the number of
+    images saved and a list of error messages.
+    '''
+
+    errors = []
+
+    # Clips are grouped by sample rate and length for compute_spectrograms()
+    clips = {}
+    for source, image_path in chunk:
+        try:
+            samples, sample_rate = _read_clip(source)
+        except Exception as e:
+            errors.append("Could not read clip for '{}': {}: {}".format(
+                image_path, type(e).__name__, e))
+            continue
+        clips.setdefault(sample_rate, []).append((samples, image_path))
+
+    num_saved = 0
+    renderer = _worker['renderer']
+
+    for sample_rate, rate_clips in clips.items():
+
+        batches = group_by_length([samples for samples, _ in rate_clips])
+
+        for indices, batch in batches:
+
+            try:
+                spectra, limits = _get_spectra(batch, sample_rate)
+            except Exception as e:
+                for i in indices:
+                    errors.append("Could not compute spectrogram for '{}': {}: {}".format(
+                        rate_clips[i][1], type(e).__name__, e))
+                continue
+
+            for i, spectrum, clip_limits in zip(indices, spectra, limits):
+                image_path = rate_clips[i][1]
+                try:
+                    renderer.save(spectrum, clip_limits, image_path)
+                    num_saved += 1
+                except Exception as e:
+                    errors.append("Could not save '{}': {}: {}".format(
+                        image_path, type(e).__name__, e))
+
+    return (num_saved, errors)
+
+
+def _get_spectra(batch, sample_rate):
+    '''Returns the spectra of a batch of clips for compute_spectrograms(),
+    and their limits, computing only those that are not in the worker's
+    cache, if it has one, and caching them'''
+
+    settings = _worker['settings']
+    cache = _worker['cache']
+
+    if cache is None:
+        spectra, _, _, limits = compute_spectrograms(batch, sample_rate,
+            return_limits=True, **settings)
+        return (spectra, limits)
+
+    keys = [get_key(samples, sample_rate, settings) for samples in batch]
+    spectrograms = [cache.get(key) for key in keys]
+    spectra = [s[0] if s is not None else None for s in spectrograms]
+    limits = [s[3] if s is not None else None for s in spectrograms]
+
+    misses = [i for i, s in enumerate(spectrograms) if s is None]
+
+    if misses:
+        computed, freqs, times, computed_limits = compute_spectrograms(
+            batch[misses], sample_rate, return_limits=True, **settings)
+        for i, spectrum, clip_limits in zip(misses, computed, computed_limits):
+            spectra[i], _, _, limits[i] = cache.put(
+                keys[i], (spectrum, freqs, times, clip_limits))
+
+    return (spectra, limits)
+
+
+def _get_dir_images(dir_path, output_dir):
+    '''Returns (clip path, image path) pairs for the .wav files in the tree
+    dir_path, with images in a tree of the same shape in output_dir, and
+    makes the directories of the tree'''
+
+    images = []
+    image_dirs = set()
+
+    for clip_path in find_files(dir_path):
+        rel_path = os.path.relpath(clip_path, dir_path)
+        image_path = os.path.join(
+            output_dir, os.path.splitext(rel_path)[0] + '.png')
+        images.append((clip_path, image_path))
+        image_dirs.add(os.path.dirname(image_path))
+
+    for image_dir in image_dirs:
+        os.makedirs(image_dir, exist_ok=True)
+
+    return images
+
+
+def _get_manifest_images(manifest_path, output_dir):
+    '''
+    Returns (clip index, image path) pairs for the clips of a manifest,
+    with images in a new run directory in output_dir, named like clip
+    files. Returns the run directory too.
+
+    Recordings are named as by the detector (see
+    file_discovery.get_recording_names()), so the images of recordings
+    with the same file name in different directories don't overwrite each
+    other. The names are those of the recordings' clip files if the
+    manifest lists detections in all of the recordings of a run.
+    '''
+
+    clips = read_manifest(manifest_path)
+    layout = OutputLayout(
+        output_dir, sorted({clip.settings_name or '' for clip in clips}))
+
+    recording_names = get_recording_names(
+        sorted({clip.recording_path for clip in clips}))
+
+    images = []
+
+    for i, clip in enumerate(clips):
+        file_name = clip_file_name(recording_names[clip.recording_path],
+            clip.start_index, clip.sample_rate, '.png')
+        images.append(
+            (i, layout.get_file_path(clip.settings_name, file_name)))
+
+    # e.g. clips listed twice, or starting in the same millisecond
+    num_paths = len({image_path for _, image_path in images})
+    if num_paths < len(images):
+        logging.warning("{} of {} clips have the same image path as another "
+            "clip, and will overwrite its image".format(
+                len(images) - num_paths, len(images)))
+
+    return (images, layout.run_dir)
+
+
+def export_spectrograms(images, manifest_path = None, settings = None,
+    renderer = 'png', size = (640, 480), jobs = 1, cache_dir = None):
+    '''
+    Saves the spectrograms of clips, given as (clip source, image path)
+    pairs: clips are read from the manifest at manifest_path, if given,
+    with sources being their indices in it, and otherwise from .wav files,
+    with sources being their paths. `settings` are keyword arguments for
+    compute_spectrograms(), by default those of make_spectrogram().
+
+    Uses a pool of `jobs` worker processes if jobs is more than 1, and the
+    spectrogram cache in cache_dir, if given. Returns the number of images
+    saved. Clips that can't be read, computed or saved are logged as
+    errors, and skipped.
+    '''
+
+    settings = settings or DEFAULT_SETTINGS
+    initargs = (manifest_path, settings, renderer, size, cache_dir)
+
+    chunks = [images[i:i + _CHUNK_SIZE]
+              for i in range(0, len(images), _CHUNK_SIZE)]
+
+    if jobs > 1:
+        with ProcessPoolExecutor(jobs, initializer=_init_worker,
+                initargs=initargs) as executor:
+            results = executor.map(_export_chunk, chunks)
+            num_saved = _log_results(results, len(images))
+
+    else:
+        _init_worker(*initargs)
+        num_saved = _log_results(map(_export_chunk, chunks), len(images))
+
+    return num_saved
+
+
+def _log_results(results, num_images):
+    '''Logs the errors and progress of the results of _export_chunk(),
+    returning the number of images saved'''
+
+    num_saved = 0
+
+    for chunk_saved, errors in results:
+        for error in errors:
+            logging.error(error)
+        num_saved += chunk_saved
+        logging.info("Saved {} of {} images".format(num_saved, num_images))
+
+    return num_saved
+
+
+def _parse_args():
+
+    parser = argparse.ArgumentParser(
+        description='Save a spectrogram image of every clip in a directory \
+            of .wav clips or a detection manifest.', add_help=True)
+
+    parser.add_argument('input',
+        help='a directory of .wav clips, or a detection manifest (.csv)')
+
+    parser.add_argument('-o', '--output', metavar='DIR', dest='output',
+        help='directory to save images in (default: next to the input)')
+
+    parser.add_argument('-j', '--jobs', metavar='N', type=int, default=1,
+        dest='jobs', help='number of processes to run (default 1)')
+
+    parser.add_argument('--renderer', choices=sorted(_RENDERERS),
+        default='png', dest='renderer',
+        help='save images directly as .png files, or with matplotlib (default png)')
+
+    parser.add_argument('--size', metavar=('WIDTH', 'HEIGHT'), type=int,
+        nargs=2, default=(640, 480), dest='size',
+        help='size of the images in pixels (default 640 480)')
+
+    parser.add_argument('--cache', metavar='DIR', nargs='?',
+        const=DEFAULT_CACHE_DIR, dest='cache',
+        help='use the spectrogram cache in DIR (default: the cache shared with the review application)')
+
+    parser.add_argument('-v', '--verbose', action='store_true',
+        dest='verbose', help='print progress')
+
+    return vars(parser.parse_args())
+
+
+def main():
+
+    input = _parse_args()
+
+    if input['verbose']:
+        logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.DEBUG)
+    else:
+        logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.WARNING)
+
+    input_path = input['input'].rstrip('/\\')
+
+    if os.path.isdir(input_path):
+        output_dir = input['output'] or input_path + '-spectrograms'
+        images = _get_dir_images(input_path, output_dir)
+        manifest_path = None
+    else:
+        output_dir = input['output'] or os.path.join(
+            os.path.dirname(os.path.abspath(input_path)), 'spectrograms')
+        images, output_dir = _get_manifest_images(input_path, output_dir)
+        manifest_path = input_path
+
+    start_time = time.time()
+    num_saved = export_spectrograms(images, manifest_path,
+        renderer=input['renderer'], size=tuple(input['size']),
+        jobs=input['jobs'], cache_dir=input['cache'])
+    elapsed = time.time() - start_time
+
+    print("Saved {} of {} spectrograms in '{}/' in {:.1f} s ({:.0f} clips/s)".format(
+        num_saved, len(images), output_dir, elapsed,
+        num_saved / elapsed if elapsed else 0))
+
+
+# Worker processes import this module, so only run main() from the command line
+if __name__ == '__main__':
+    main()
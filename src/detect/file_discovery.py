@@ -0,0 +1,161 @@
+'''
+file_discovery.py
+
+Finding the recordings to run the detector on, and the order to run it
+on them in.
+
+Recordings are found by scanning a directory tree with os.scandir, which
+lists each directory with a single system call and knows which entries
+are files without checking each one separately, or are read from a list
+of paths (see read_file_list()).
+
+Output files are named after recordings, by their file names, except
+where recordings in different directories have the same file name (see
+get_recording_names()).
+
+Recordings are processed longest first (see order_longest_first()): when
+processing them in parallel, starting the longest ones first keeps one
+long recording from being left running on its own at the end of a run.
+'''
+
+import fnmatch
+import hashlib
+import logging
+import os
+
+from audio_file_utils import AudioFileFormatError, get_wave_file_info
+
+
+DEFAULT_INCLUDE = ('*.wav',)
+
+
+def find_files(dir_path, include = DEFAULT_INCLUDE, exclude = ()):
+    '''
+    Generates the paths of the files in the directory tree dir_path that
+    match any of the glob patterns in include and none of those in
+    exclude. Patterns are matched against paths relative to dir_path,
+    with "/" separating directories, e.g. "2018-04/*.wav" or "*/noise*".
+    Directories are scanned in order of name, and so are their files.
+    '''
+
+    # directories still to scan, as (path, path relative to dir_path) pairs
+    dirs = [(dir_path, '')]
+
+    while dirs:
+
+        dir_path, rel_dir_path = dirs.pop()
+
+        try:
+            with os.scandir(dir_path) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError as e:
+            logging.warning("Could not scan '{}': {}".format(dir_path, e))
+            continue
+
+        subdirs = []
+
+        for entry in entries:
+
+            rel_path = rel_dir_path + entry.name
+
+            if entry.is_dir():
+                subdirs.append((entry.path, rel_path + '/'))
+
+            elif entry.is_file() and _matches(rel_path, include) and \
+                    not _matches(rel_path, exclude):
+                yield entry.path
+
+        # scanned last in, first out, so reversed to scan them in order
+        dirs.extend(reversed(subdirs))
+
+
+def _matches(path, patterns):
+    return any(fnmatch.fnmatch(path, pattern) for pattern in patterns)
+
+
+def read_file_list(file_):
+    '''
+    Returns the paths listed in an open text file, one per line. Blank
+    lines and lines starting with "#" are ignored, as are paths of files
+    that don't exist, with a warning.
+    '''
+
+    paths = []
+
+    for line in file_:
+
+        path = line.strip()
+
+        if not path or path.startswith('#'):
+            continue
+
+        if os.path.isfile(path):
+            paths.append(path)
+        else:
+            logging.warning("Skipping '{}': not a file".format(path))
+
+    return paths
+
+
+def get_recording_names(paths):
+    '''
+    Returns a dictionary of the names to give the output files of the
+    recordings at paths, by path. A recording is named by its file name
+    without its extension, e.g. "rec" for "n1/rec.wav", unless recordings
+    in other directories have the same file name. Those are named by their
+    paths relative to the directory all of the recordings are in instead,
+    with "_" separating directories, e.g. "n1_rec" and "n2_rec", so that
+    their outputs don't overwrite each other. A name that is still not
+    unique gets a hash of the recording's path appended to it.
+    '''
+
+    abs_paths = {path: os.path.abspath(path) for path in paths}
+
+    by_name = {}
+    for path, abs_path in abs_paths.items():
+        name = os.path.splitext(os.path.basename(abs_path))[0]
+        by_name.setdefault(name, set()).add(abs_path)
+
+    names = {}
+
+    if len(set(abs_paths.values())) > 1:
+        root = os.path.commonpath(list(abs_paths.values()))
+    else:
+        root = None
+
+    for path, abs_path in abs_paths.items():
+        name = os.path.splitext(os.path.basename(abs_path))[0]
+        if len(by_name[name]) > 1:
+            rel_path = os.path.splitext(os.path.relpath(abs_path, root))[0]
+            name = rel_path.replace(os.sep, '_')
+        names[path] = name
+
+    # e.g. "n1_rec" for both "n1/rec.wav" and "n1_rec.wav"
+    counts = {}
+    for abs_path, name in set((abs_paths[path], name)
+                              for path, name in names.items()):
+        counts[name] = counts.get(name, 0) + 1
+    for path, name in names.items():
+        if counts[name] > 1:
+            digest = hashlib.sha1(abs_paths[path].encode('utf-8')).hexdigest()
+            names[path] = '{}-{}'.format(name, digest[:8])
+
+    return names
+
+
+def order_longest_first(paths):
+    '''
+    Returns paths sorted by the lengths in samples of the recordings, from
+    their headers, longest first. Files whose headers can't be read come
+    last, so the errors in them are reported with the rest of the run.
+    '''
+
+    return sorted(paths, key=lambda path: (-_get_length(path), path))
+
+
+def _get_length(path):
+    try:
+        return get_wave_file_info(path).length
+    except (AudioFileFormatError, OSError) as e:
+        logging.debug("Could not read header of '{}': {}".format(path, e))
+        return -1
@@ -0,0 +1,172 @@
+'''
+ledger.py
+
+A persistent record of the recordings that have been processed, so that
+re-running the detector on a directory skips the recordings it has
+already processed with the same settings.
+
+The ledger is an SQLite database. A recording is listed once its
+detections have all been saved, and only counts as processed while its
+size and modification time are unchanged and it is looked up with the
+same settings fingerprint (see settings_fingerprint()). A run that is
+interrupted partway through thus picks up where it left off, and
+recordings are processed again if they change or the settings do.
+
+The ledger also keeps each recording's detections, so that a re-run can
+list the detections of the recordings it skips in its manifest.
+'''
+
+import hashlib
+import os
+import sqlite3
+from datetime import datetime
+
+from bunch import Bunch
+
+
+_SCHEMA = '''
+    create table if not exists files (
+        path text not null,
+        fingerprint text not null,
+        size integer not null,
+        mtime_ns integer not null,
+        sample_rate real not null,
+        completed text not null,
+        primary key (path, fingerprint));
+
+    create table if not exists detections (
+        path text not null,
+        fingerprint text not null,
+        settings_name text,
+        start_index integer not null,
+        length integer not null);
+
+    create index if not exists detections_file
+        on detections (path, fingerprint);
+'''
+
+
+def settings_fingerprint(*settings):
+    '''
+    Returns a short string identifying the given settings, which may be
+    Bunches (such as detector settings), lists of them, or other values
+    with stable reprs, such as strings, numbers, and None.
+    '''
+
+    text = repr([_canonical(s) for s in settings])
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+
+def _canonical(value):
+    '''Returns a value with a stable repr: Bunches and dicts are turned
+    into sorted lists of items'''
+
+    if isinstance(value, Bunch):
+        value = value.__dict__
+
+    if isinstance(value, dict):
+        return sorted((k, _canonical(v)) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    else:
+        return value
+
+
+class Ledger:
+    '''
+    The ledger of processed recordings in an SQLite database file, created
+    if it doesn't exist yet. Use as a context manager, or call close() when
+    done:
+
+        with Ledger('ledger.sqlite') as ledger:
+            if ledger.get_detections(path, fingerprint) is None:
+                ...process the recording...
+                ledger.record(path, fingerprint, sample_rate, detections)
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        self._connection.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._connection.close()
+
+    def get_detections(self, file_path, fingerprint):
+        '''
+        Returns the detections recorded for a recording processed with the
+        settings identified by fingerprint, or None if it hasn't been, or
+        has changed since.
+
+        The detections are returned as a Bunch holding the recording's
+        sample rate and a list of (settings name, detections) pairs, where
+        detections is a list of (start index, length) pairs.
+        '''
+
+        file_path = os.path.abspath(file_path)
+        size, mtime_ns = get_file_stamp(file_path)
+
+        row = self._connection.execute(
+            'select sample_rate from files where path = ? and '
+            'fingerprint = ? and size = ? and mtime_ns = ?',
+            (file_path, fingerprint, size, mtime_ns)).fetchone()
+
+        if row is None:
+            return None
+
+        detections = {}
+        for name, start_index, length in self._connection.execute(
+                'select settings_name, start_index, length from detections '
+                'where path = ? and fingerprint = ? order by rowid',
+                (file_path, fingerprint)):
+            detections.setdefault(name, []).append((start_index, length))
+
+        return Bunch(sample_rate=row[0], detections=list(detections.items()))
+
+    def record(self, file_path, fingerprint, sample_rate, detections,
+            file_stamp=None):
+        '''
+        Records that a recording has been processed with the settings
+        identified by fingerprint. detections is a list of (settings name,
+        detections) pairs as returned by get_detections().
+
+        file_stamp is the recording's (size, modification time) pair as
+        returned by get_file_stamp() before it was processed, so that 
+        changes made while it was processed are noticed. By default it is
+        read now.
+        '''
+
+        file_path = os.path.abspath(file_path)
+        size, mtime_ns = file_stamp or get_file_stamp(file_path)
+        completed = datetime.now().isoformat(timespec='seconds')
+
+        # One transaction per recording, so a recording is either listed
+        # with all of its detections or not at all
+        with self._connection:
+
+            self._connection.execute(
+                'delete from detections where path = ? and fingerprint = ?',
+                (file_path, fingerprint))
+
+            self._connection.execute(
+                'insert or replace into files values (?, ?, ?, ?, ?, ?)',
+                (file_path, fingerprint, size, mtime_ns, sample_rate,
+                 completed))
+
+            self._connection.executemany(
+                'insert into detections values (?, ?, ?, ?, ?)',
+                ((file_path, fingerprint, name, start_index, length)
+                 for name, clips in detections
+                 for start_index, length in clips))
+
+
+def get_file_stamp(file_path):
+    '''Returns the (size, modification time) pair of a file'''
+    stat = os.stat(file_path)
+    return (stat.st_size, stat.st_mtime_ns)
@@ -17,7 +17,11 @@ given computer.  The reimplementations remove all of these restrictions.
 '''
 
 
+import functools
+import hashlib
 import math
+import os
+
 import numpy as np
 import scipy.linalg as linalg
 import scipy.signal as signal
@@ -36,6 +40,11 @@ periods to units of seconds.
 """
 
 
+# RECR: see "Caching of signal processor designs" below
+_DESIGN_CACHE_SIZE = 64
+"""maximum number of designs of each kind to cache in memory."""
+
+
 _TSEEP_SETTINGS = Bunch(
     filter_f0=6000,                     # hertz
     filter_f1=10000,                    # hertz
@@ -172,18 +181,46 @@ class _Detector:
     """
     
     
-    def __init__(self, settings, sample_rate, listener):
+    def __init__(
+            self, settings, sample_rate, listener, decimate=False,
+            dtype='float64'):
         
         self._settings = settings
         self._sample_rate = sample_rate
         self._listener = listener
         
+        # RECR: the floating point type in which to process samples.
+        # Processing in `float32` rather than `float64` halves the memory
+        # used by, and the memory bandwidth needed for, signal processing.
+        self._dtype = np.dtype(dtype)
+        
+        # RECR: optionally decimate the input to the lowest sample rate
+        # the settings allow before processing it (see `_Decimator`).
+        # All of the processing that follows is designed for, and all
+        # of the indices it computes are at, the decimated rate.
+        if decimate:
+            factor = _get_decimation_factor(settings, sample_rate)
+        else:
+            factor = 1
+        if factor > 1:
+            self._decimator = _Decimator(factor, sample_rate, self._dtype)
+        else:
+            self._decimator = None
+        self._decimation_factor = factor
+        self._processing_rate = sample_rate / factor
+        
         self._signal_processor = self._create_signal_processor()
         self._series_processor = self._create_series_processor()
         
         self._num_samples_processed = 0
-        self._recent_samples = np.array([[], []], dtype='float')
-        self._initial_samples_repeated = False
+        
+        # RECR: one-dimensional, so it can be concatenated with the
+        # one-dimensional sample arrays passed to `detect`
+        self._recent_samples = np.array([], dtype=self._dtype)
+        
+        # RECR: list of threshold crossings recorded instead of being
+        # processed, or `None` if not recording (see `_process_crossings`)
+        self._recorded_crossings = None
         
 #         self._crossings_handler = _CrossingsHandler(sample_rate)
 #         self._lines = []
@@ -191,59 +228,36 @@ class _Detector:
     
     def _create_signal_processor(self):
         
-        coefficients = self._design_filter()
-        
         s = self.settings
         
-        integration_length = int(round(s.integration_time * self.sample_rate))
-        
-        # We use `math.floor` here rather than `round` since the Simulink
-        # .mdl files we have access to suggest that the original Old Bird
-        # detectors use MATLAB's `fix`  function, which rounds towards zero.
-        delay = math.floor(s.ratio_delay * self.sample_rate)
-        
-        processors = [
-            _FirFilter(coefficients),
-            _Squarer(),
-            _Integrator(integration_length),
-            _Divider(delay),
+        # RECR: designs are cached, since they are the same for every
+        # file of a batch with the same settings and sample rate
+        coefficients, integration_length, delay = _design_signal_processor(
+            s.filter_duration, s.filter_f0, s.filter_f1, s.filter_bw,
+            s.integration_time, s.ratio_delay, self.processing_rate)
+        
+        coefficients = coefficients.astype(self._dtype)
+        
+        # RECR: each processor is paired with a key that identifies its
+        # configuration, so that a `MultiDetector` can share the outputs
+        # of identical processing stages among detectors.
+        self._signal_processor_stages = [
+            (('filter', coefficients.tobytes()), _FirFilter(coefficients)),
+            (('square',), _Squarer()),
+            (('integrate', integration_length),
+             _Integrator(integration_length)),
+            (('divide', delay), _Divider(delay)),
         ]
         
-        return _SignalProcessorChain(processors)
-        
+        processors = [p for _, p in self._signal_processor_stages]
         
-    def _design_filter(self):
-        
-        s = self.settings
-        
-        # We use a filter length that is proportional to the sample rate,
-        # and that is 100 when the sample rate is 22050 hertz. (The original
-        # Old Bird detectors were intended for 22050 hertz input only, and
-        # their filters had length 100.)
-        #
-        # Varying the filter length in this way yields filters with very
-        # similar frequency responses at different sample rates. See the
-        # Jupyter notebook
-        # "Old Bird Detector Filter at Different Sample Rates.ipynb" in
-        # the "HaroldMills/Vesper-Tseep-Thrush" GitHub repository for a
-        # demonstration of this for the Tseep and Thrush detector filters..
-        filter_length = int(round(s.filter_duration * self.sample_rate))
-        
-        f0 = s.filter_f0
-        f1 = s.filter_f1
-        bw = s.filter_bw
-        fs2 = self.sample_rate / 2
-        bands = np.array([0, f0 - bw, f0, f1, f1 + bw, fs2]) / fs2
+        return _SignalProcessorChain(processors)
         
-        desired = np.array([0, 0, 1, 1, 0, 0])
         
-        return _firls(filter_length, bands, desired)
-    
-    
     def _create_series_processor(self):
         
         s = self.settings
-        sample_rate = self.sample_rate
+        sample_rate = self.processing_rate
         
         # We use `math.floor` here rather than `round` since the Simulink
         # .mdl files we have access to suggest that the original Old Bird
@@ -278,24 +292,63 @@ class _Detector:
         return self._sample_rate
     
     
+    @property
+    def dtype(self):
+        return self._dtype
+    
+    
+    @property
+    def decimation_factor(self):
+        return self._decimation_factor
+    
+    
+    @property
+    def processing_rate(self):
+        
+        """
+        the sample rate at which the detector processes its input, in hertz.
+        
+        This is the input sample rate divided by the decimation factor.
+        """
+        
+        return self._processing_rate
+    
+    
     @property
     def listener(self):
         return self._transient_finder.listener
     
     
     def detect(self, samples):
-        # RECR: test script to fix problems with array dimension error in assignment to augmented_samples
-        '''
-        print(self._recent_samples)
-        print(samples)
-        if (samples[0].any() == samples[1].any()):
-            print("Same")
-        '''
-        
-        # RECR: modified from original old_bird_detector_redux_1_1
-        augmented_samples = samples #was: np.concatenate((self._recent_samples, samples))
-        
-        if len(augmented_samples) <= self._signal_processor.latency:
+        
+        """
+        Runs the detector on the next block of samples.
+        
+        `samples` is a one-dimensional array of samples that immediately
+        follow the samples of the previous call to this method, if any.
+        The detector keeps only the samples it needs to carry filter,
+        integrator, and divider state across calls, so memory use does
+        not grow with the total length of the input, and running the
+        detector on consecutive blocks of a recording yields the same
+        clips as running it once on the whole recording.
+        """
+        
+        if self._decimator is not None:
+            samples = self._decimator.process(samples)
+            
+        # RECR: restored concatenation with recent samples (previously
+        # commented out due to an array dimension error) so that `detect`
+        # can be called repeatedly with consecutive blocks of samples.
+        # This also converts the samples to the processing type.
+        augmented_samples = np.concatenate(
+            (self._recent_samples, samples)).astype(self._dtype, copy=False)
+        
+        # Index of the first sample of `augmented_samples` in the input.
+        start_index = self._num_samples_processed - len(self._recent_samples)
+        
+        latency = self._signal_processor.latency
+        
+        if len(augmented_samples) <= latency:
             # don't yet have enough samples to fill processing pipeline
             
             self._recent_samples = augmented_samples
@@ -306,56 +359,91 @@ class _Detector:
             # Run signal processors on samples.
             ratios = self._signal_processor.process(augmented_samples)
             
-            # Get transient index offset.
-            offset = self._num_samples_processed
-            if not self._initial_samples_repeated:
-                offset += self._signal_processor.latency
-                self._initial_samples_repeated = True
-                
-            # Add one to offset for agreement with original Old Bird detector.
-            offset += 1
-                
-            crossings = self._get_threshold_crossings(ratios, offset)
-            
-#             self._crossings_handler.handle_crossings(crossings, self._lines)
-            
-            clips = self._series_processor.process(crossings)
+            self._process_ratios(ratios, start_index + latency)
             
-            self._notify_listener(clips)
-            
-            # Save trailing samples for next call to this method.
-            self._recent_samples = \
-                augmented_samples[-self._signal_processor.latency:]
+            # RECR: Save trailing samples for next call to this method.
+            # The signal processor chain consumes one sample more than its
+            # latency (the divider drops `delay` samples, but has latency
+            # `delay - 1`), and we keep one more sample than that so that
+            # the next call recomputes the last ratio of this call and
+            # can detect threshold crossings that straddle the two calls.
+            self._recent_samples = augmented_samples[-(latency + 2):]
             
         self._num_samples_processed += len(samples)
             
             
+    def _process_ratios(self, ratios, offset):
+        
+        """
+        Finds clips in ratios computed by the signal processor and
+        notifies the listener of them.
+        
+        `offset` is the index of the first of the samples from which
+        the ratios were computed plus the signal processor latency.
+        """
+        
+        # Add one to offset for agreement with original Old Bird detector.
+        offset += 1
+            
+        crossings = self._get_threshold_crossings(ratios, offset)
+        
+#         self._crossings_handler.handle_crossings(crossings, self._lines)
+        
+        self._process_crossings(crossings)
+        
+        
+    def _process_crossings(self, crossings):
+        
+        # RECR: when detecting in segments (see `get_segment_crossings`),
+        # record crossings rather than finding clips in them.
+        if self._recorded_crossings is not None:
+            self._recorded_crossings.append(crossings)
+            return
+        
+        clips = self._series_processor.process(crossings)
+        
+        self._notify_listener(clips)
+        
+        
     def _get_threshold_crossings(self, ratios, offset):
     
         # Add one to index offset to compensate for processing latency
         # of this method.
         offset += 1
         
-        x0 = ratios[:-1]
-        x1 = ratios[1:]
+        # RECR: compare each ratio with each threshold only once, rather
+        # than once as the first and once as the second of a pair.
         
         # Find indices where ratio rises above threshold.
         t = self.settings.ratio_threshold
-        rise_indices = np.where((x0 <= t) & (x1 > t))[0] + offset
+        above = ratios > t
+        rise_indices = np.nonzero(~above[:-1] & above[1:])[0] + offset
         
         # Find indices where ratio falls below threshold inverse.
         t = 1 / t
-        fall_indices = np.where((x0 >= t) & (x1 < t))[0] + offset
+        below = ratios < t
+        fall_indices = np.nonzero(~below[:-1] & below[1:])[0] + offset
 
-        # Tag rises and falls with booleans, combine, and sort.
-        return sorted(
-            [(i, True) for i in rise_indices] +
-            [(i, False) for i in fall_indices])
+        # RECR: Tag rises and falls with booleans, combine, and sort,
+        # keeping indices and tags in separate arrays rather than making
+        # a list of tuples. As with sorted tuples, a fall precedes a rise
+        # at the same index.
+        indices = np.concatenate((rise_indices, fall_indices))
+        rises = np.zeros(len(indices), dtype='bool')
+        rises[:len(rise_indices)] = True
+        order = np.lexsort((rises, indices))
+        return (indices[order], rises[order])
     
     
     def _notify_listener(self, clips):
         
-        for start_index, length in clips:
+        start_indices, lengths = clips
+        
+        if self._decimator is not None:
+            # Map clips from the decimated rate back to the input rate.
+            start_indices, lengths = self._decimator.map_clips(clips)
+            
+        for start_index, length in zip(start_indices.tolist(), lengths.tolist()):
             
 #             start_time = _get_dt(start_index, self.sample_rate)
 #             start_time += datetime.timedelta(seconds=3000 / self.sample_rate)
@@ -380,8 +468,8 @@ class _Detector:
         # terminate a transient that may have started more than the
         # minimum clip duration before the end of the input but for
         # which for whatever reason there has not yet been a fall.
-        fall = (self._num_samples_processed, False)
-        clips = self._series_processor.complete_processing([fall])
+        fall = (np.array([self._num_samples_processed]), np.array([False]))
+        clips = self._series_processor.complete_processing(fall)
         self._notify_listener(clips)
 
 #         self._lines.sort()
@@ -426,25 +514,83 @@ class _Squarer(_SignalProcessor):
     
     
     def process(self, x):
-        return x * x
-    
-    
-class _Integrator(_FirFilter):
-    
-    # An alternative to making this class an `_FirFilter` subclass would
-    # be to use the `np.cumsum` function to compute the cumulative sum
-    # of the input and then the difference between the result and a
-    # delayed version of the result. That approach is more efficient
-    # but it has numerical problems for sufficiently long inputs
-    # (the cumulative sum of the squared samples grows ever larger, but
-    # the samples do not, so you'll eventually start throwing away sample
-    # bits), so I have chosen not to use it. An alternative would be to use
-    # Cython or Numba or something like that to implement the integration
-    # in a way that is both faster and accurate for arbitrarily long inputs.
+        
+        # RECR: square in place rather than allocating another array.
+        # The input is always the output of the preceding filter, which
+        # nothing else uses.
+        return np.square(x, out=x)
+    
+    
+class _Integrator(_SignalProcessor):
+    
+    # RECR: This class was originally an `_FirFilter` subclass with
+    # `integration_length` coefficients of `1 / integration_length`,
+    # which made integration the most expensive signal processing stage
+    # at high sample rates. The alternative of computing the cumulative
+    # sum of the input and then the difference between the result and a
+    # delayed version of the result is much more efficient, but has
+    # numerical problems for sufficiently long inputs (the cumulative
+    # sum of the squared samples grows ever larger, but the samples do
+    # not, so you'll eventually start throwing away sample bits).
+    #
+    # This class computes the same moving sums in linear time without
+    # that problem by restarting the cumulative sum at the start of
+    # every block of `integration_length` samples. Since an integration
+    # window spans at most two consecutive blocks, each moving sum is
+    # the sum of the tail of one block and the head of the next, both
+    # of which are available from the blockwise cumulative sums. Each
+    # cumulative sum has at most `integration_length` terms, so the
+    # rounding error of an output is at most about `integration_length`
+    # times machine epsilon times the sum of the inputs in the two
+    # blocks its window spans, regardless of the length of the input.
+    # For the nonnegative inputs we integrate, that is comparable to
+    # the error of the FIR filter implementation, whose error bound
+    # grows instead with the sum of the whole input.
+    #
+    # The sums are always computed in `float64`, even when the detector
+    # processes samples in `float32`. The inputs span many orders of
+    # magnitude, and after a loud sound the sum of the quiet samples
+    # that follow it is the difference of two large cumulative sums. In
+    # `float32` that difference loses most or all of its bits (it comes
+    # out as exactly zero after a sound 80 dB above the noise), so the
+    # detector would see false rises. Only the output is cast back to
+    # the type of the input.
     
     def __init__(self, integration_length):
-        coefficients = np.ones(integration_length) / integration_length
-        super().__init__(coefficients)
+        super().__init__(integration_length - 1)
+        self._integration_length = integration_length
+        
+        
+    def process(self, x):
+        
+        n = self._integration_length
+        output_length = len(x) - n + 1
+        
+        if output_length <= 0:
+            return np.zeros(0, dtype=x.dtype)
+        
+        # Compute cumulative sums of blocks of `n` samples, padding the
+        # input with zeros to fill at least one more block than the
+        # integration windows start in.
+        num_blocks = len(x) // n + 1
+        sums = np.zeros((num_blocks, n), dtype='float64')
+        sums.reshape(-1)[:len(x)] = x
+        np.cumsum(sums, axis=1, out=sums)
+        totals = sums[:, -1]
+        
+        # The window that starts `r` samples into block `b` sums the
+        # whole of block `b` when `r` is zero, and otherwise sums the
+        # last `n - r` samples of block `b` and the first `r` samples
+        # of block `b + 1`.
+        y = np.empty((num_blocks - 1, n), dtype='float64')
+        y[:, 0] = totals[:-1]
+        np.subtract(sums[1:, :-1], sums[:-1, :-1], out=y[:, 1:])
+        y[:, 1:] += totals[:-1, np.newaxis]
+        
+        y = y.reshape(-1)[:output_length]
+        y /= n
+        
+        return y.astype(x.dtype, copy=False)
 
 
 class _Divider(_SignalProcessor):
@@ -458,8 +604,9 @@ class _Divider(_SignalProcessor):
     def process(self, x):
         
         # Avoid potential divide-by-zero issues by replacing zero values
-        # with very small ones.
-        x[np.where(x == 0)] = 1e-20
+        # with very small ones. (RECR: with a boolean mask, which is
+        # cheaper than the index array of `np.where`.)
+        x[x == 0] = 1e-20
         
         return x[self._delay:] / x[:-self._delay]
              
@@ -479,6 +626,150 @@ class _SignalProcessorChain(_SignalProcessor):
         return x
     
     
+# RECR: Series processors operate on pairs of NumPy arrays rather than on
+# lists of tuples. Threshold crossings are `(indices, rises)` pairs, where
+# `rises` is a boolean array that is `True` for rises and `False` for
+# falls, and clips are `(start_indices, lengths)` pairs of integer arrays.
+
+
+def _clip_arrays(clips):
+    
+    """Converts a list of `(start_index, length)` tuples to clip arrays."""
+    
+    clips = np.array(clips, dtype='int64').reshape((-1, 2))
+    return (clips[:, 0], clips[:, 1])
+
+
+# RECR: New class for decimating input before detection
+class _Decimator:
+    
+    """
+    Lowpass filters and downsamples a signal by an integer factor.
+    
+    The detectors pass only a band of frequencies, and for input with a
+    sample rate that is high compared to the top of that band, much of
+    the work of the signal processors can be avoided by processing the
+    input at a lower sample rate. A `_Decimator` computes every
+    `factor`th output of a linear phase lowpass filter whose passband
+    extends to `_DECIMATION_BANDWIDTH_FRACTION` of the output Nyquist
+    frequency, using a polyphase implementation that computes only
+    those outputs.
+    
+    Like the `detect` method of a detector, the `process` method of a
+    decimator can be called repeatedly with consecutive sample arrays,
+    with the same output as for a single call with all of the input.
+    
+    Output sample `i` corresponds to input sample `factor * i - delay`,
+    where `delay` is the delay of the lowpass filter.
+    """
+    
+    
+    def __init__(self, factor, sample_rate, dtype='float64'):
+        
+        self._factor = factor
+        self._coefficients = \
+            _design_decimation_filter(factor, sample_rate).astype(dtype)
+        
+        # We use an odd-length filter, whose delay is a whole number of
+        # samples.
+        self._delay = (len(self._coefficients) - 1) // 2
+        
+        # We start with enough zeros that the first output is the one
+        # whose filter window ends at input sample zero.
+        n = len(self._coefficients) - 1
+        self._recent_samples = np.zeros(-(-n // factor) * factor, dtype=dtype)
+        
+        
+    @property
+    def factor(self):
+        return self._factor
+    
+    
+    @property
+    def delay(self):
+        return self._delay
+    
+    
+    def process(self, samples):
+        
+        dtype = self._coefficients.dtype
+        x = np.concatenate((self._recent_samples, samples)).astype(
+            dtype, copy=False)
+        q = self._factor
+        n = len(self._coefficients) - 1
+        
+        # The first sample of `x` is always a multiple of `q` samples
+        # from the start of the (zero-padded) input, so the outputs of
+        # `upfirdn` below are outputs of the decimator. We use those
+        # whose filter windows lie within `x`, i.e. that end at sample
+        # `k * q` of `x` for `first <= k < end`.
+        first = -(-n // q)
+        end = (len(x) - 1) // q + 1
+        
+        if end <= first:
+            y = np.zeros(0, dtype=dtype)
+            start = 0
+        else:
+            y = signal.upfirdn(self._coefficients, x, 1, q)[first:end]
+            
+            # Keep the samples from the start of the window of output
+            # `end` (rounded down to a multiple of `q`) on, so that it
+            # will be output `first` of the next call.
+            start = (end - first) * q
+            
+        self._recent_samples = x[start:]
+        
+        return y
+    
+    
+    def map_clips(self, clips):
+        
+        """Maps clips from the output sample rate to the input sample rate."""
+        
+        start_indices, lengths = clips
+        start_indices = np.maximum(start_indices * self._factor - self._delay, 0)
+        return (start_indices, lengths * self._factor)
+    
+    
+_DECIMATION_BANDWIDTH_FRACTION = .8
+"""
+largest fraction of the decimated Nyquist frequency at which the top of
+a detector passband may lie.
+"""
+
+
+def _get_decimation_factor(settings, sample_rate):
+    
+    """
+    Gets the largest factor by which input of the specified sample rate
+    can be decimated without disturbing the passband of a detector with
+    the specified settings.
+    """
+    
+    f_max = settings.filter_f1 + settings.filter_bw
+    return max(int(_DECIMATION_BANDWIDTH_FRACTION * sample_rate / (2 * f_max)), 1)
+
+
+@functools.lru_cache(maxsize=_DESIGN_CACHE_SIZE)
+def _design_decimation_filter(factor, sample_rate):
+    
+    # The lowpass filter cuts off at the decimated Nyquist frequency. Its
+    # transition band can extend from the top of the passband we must
+    # preserve to that frequency's image about the decimated Nyquist
+    # frequency, since anything aliased into that range lies above the
+    # detector passband. The filter length follows the usual estimate
+    # for a Hamming window design with that transition band.
+    output_rate = sample_rate / factor
+    f_max = _DECIMATION_BANDWIDTH_FRACTION * output_rate / 2
+    transition_width = output_rate - 2 * f_max
+    length = int(math.ceil(3.3 * sample_rate / transition_width))
+    length += 1 - length % 2
+    
+    return _load_or_design_filter(
+        'decimation', (factor, sample_rate),
+        lambda: signal.firwin(length, 1 / factor))
+
+
 class _SeriesProcessor:
     
     
@@ -518,10 +809,16 @@ class _TransientFinder(_SeriesProcessor):
         
     def process(self, crossings):
         
+        # RECR: This state machine is inherently sequential, so unlike
+        # the other series processors it iterates over its input, but
+        # over plain Python integers and booleans rather than NumPy
+        # scalars, which is much faster.
+        indices, rises = crossings
+        
         transients = []
         emit = transients.append
         
-        for index, rise in crossings:
+        for index, rise in zip(indices.tolist(), rises.tolist()):
     
             if self._state == _STATE_DOWN:
     
@@ -621,7 +918,7 @@ class _TransientFinder(_SeriesProcessor):
     
                     # Do nothing for fall before end of minimal transient.
 
-        return transients
+        return _clip_arrays(transients)
     
     
 class _ClipExtender(_SeriesProcessor):
@@ -632,12 +929,8 @@ class _ClipExtender(_SeriesProcessor):
         
         
     def process(self, clips):
-        return [self._extend_clip(clip) for clip in clips]
-    
-    
-    def _extend_clip(self, clip):
-        start_index, length = clip
-        return (start_index, length + self._extension_length)
+        start_indices, lengths = clips
+        return (start_indices, lengths + self._extension_length)
             
         
 class _ClipMerger(_SeriesProcessor):
@@ -652,7 +945,7 @@ class _ClipMerger(_SeriesProcessor):
         
         merged_clips = []
         
-        for start_index, length in clips:
+        for start_index, length in zip(*[a.tolist() for a in clips]):
             
             if self._prev_start_index is None:
                 # first clip
@@ -672,7 +965,7 @@ class _ClipMerger(_SeriesProcessor):
                 self._append_previous_clip(merged_clips)
                 self._remember_clip(start_index, length)
                 
-        return merged_clips
+        return _clip_arrays(merged_clips)
     
     
     def _remember_clip(self, start_index, length):
@@ -687,14 +980,14 @@ class _ClipMerger(_SeriesProcessor):
 
     def complete_processing(self, clips):
         
-        merged_clips = self.process(clips)
+        merged_clips = list(zip(*[a.tolist() for a in self.process(clips)]))
         
         if self._prev_start_index is not None:
             # one more clip to emit
             
             self._append_previous_clip(merged_clips)
             
-        return merged_clips
+        return _clip_arrays(merged_clips)
 
         
 class _ClipSuppressor(_SeriesProcessor):
@@ -712,7 +1005,7 @@ class _ClipSuppressor(_SeriesProcessor):
         
         indices = self._recent_start_indices
              
-        for start_index, length in clips:
+        for start_index, length in zip(*[a.tolist() for a in clips]):
             
             # Remember clip.
             indices.append(start_index)
@@ -736,7 +1029,7 @@ class _ClipSuppressor(_SeriesProcessor):
             # If we get here, the clip was not suppressed.
             unsuppressed_clips.append((start_index, length))
             
-        return unsuppressed_clips
+        return _clip_arrays(unsuppressed_clips)
         
         
 _BUFFER_SIZE = 8192
@@ -749,24 +1042,20 @@ class _ClipTruncator(_SeriesProcessor):
     
     def process(self, clips):
         
-        processed_clips = []
+        start_indices, lengths = clips
         
-        for start_index, length in clips:
-            
-            end_index = start_index + length
-            
-            final_segment_length = end_index % _BUFFER_SIZE
-            
-            initial_segment_length = \
-                min(length - final_segment_length, _OVERLAP_SIZE)
-                
-            length = initial_segment_length + final_segment_length
-            
-            start_index = end_index - length
-            
-            processed_clips.append((start_index, length))
+        end_indices = start_indices + lengths
+        
+        final_segment_lengths = end_indices % _BUFFER_SIZE
+        
+        initial_segment_lengths = \
+            np.minimum(lengths - final_segment_lengths, _OVERLAP_SIZE)
             
-        return processed_clips
+        lengths = initial_segment_lengths + final_segment_lengths
+        
+        start_indices = end_indices - lengths
+        
+        return (start_indices, lengths)
             
     
 class _ClipShifter(_SeriesProcessor):
@@ -777,13 +1066,9 @@ class _ClipShifter(_SeriesProcessor):
         
         
     def process(self, clips):
-        return [self._shift_clip(clip) for clip in clips]
-    
-    
-    def _shift_clip(self, clip):
-        start_index, length = clip
-        start_index = max(start_index + self._shift, 0)
-        return (start_index, length)
+        start_indices, lengths = clips
+        start_indices = np.maximum(start_indices + self._shift, 0)
+        return (start_indices, lengths)
             
         
 class _SeriesProcessorChain(_SeriesProcessor):
@@ -811,8 +1096,9 @@ class TseepDetector(_Detector):
     extension_name = 'Old Bird Tseep Detector Redux 1.1'
     
     
-    def __init__(self, sample_rate, listener):
-        super().__init__(_TSEEP_SETTINGS, sample_rate, listener)
+    def __init__(self, sample_rate, listener, decimate=False, dtype='float64'):
+        super().__init__(
+            _TSEEP_SETTINGS, sample_rate, listener, decimate, dtype)
 
     
 class ThrushDetector(_Detector):
@@ -821,34 +1107,466 @@ class ThrushDetector(_Detector):
     extension_name = 'Old Bird Thrush Detector Redux 1.1'
     
     
-    def __init__(self, sample_rate, listener):
-        super().__init__(_THRUSH_SETTINGS, sample_rate, listener)
+    def __init__(self, sample_rate, listener, decimate=False, dtype='float64'):
+        super().__init__(
+            _THRUSH_SETTINGS, sample_rate, listener, decimate, dtype)
         
 
+# RECR: Settings for each crossbill call type
+_CROSSBILL_SETTINGS = {
+    2: _CROSSBILL_SETTINGS_2,
+    6: _CROSSBILL_SETTINGS_6,
+}
+
+# RECR: Crossbill call types that there are settings for
+CROSSBILL_TYPES = tuple(sorted(_CROSSBILL_SETTINGS))
+
+
+# RECR: New function for looking up crossbill settings by call type
+def get_crossbill_settings(type):
+    
+    """Gets the detector settings for the specified crossbill call type."""
+    
+    try:
+        return _CROSSBILL_SETTINGS[type]
+    except KeyError:
+        raise ValueError(
+            'No detector settings for crossbill call type {}.'.format(type))
+
+
 # RECR: New class for detecting crossbills
 class CrossbillDetector(_Detector):
     
     extension_name = 'Crossbill Detector'
     
-    def __init__(self, sample_rate, listener, type):
-    # Different settings for different types?
-        settings_dict = {
-            2: _CROSSBILL_SETTINGS_2,
-            6: _CROSSBILL_SETTINGS_6,
-            }
-    
-        settings = settings_dict[type]
-        super().__init__(settings, sample_rate, listener)
+    def __init__(
+            self, sample_rate, listener, type, decimate=False,
+            dtype='float64'):
+        settings = get_crossbill_settings(type)
+        super().__init__(settings, sample_rate, listener, decimate, dtype)
 
 # RECR: New class that allows user to input own settings        
 class OpenDetector(_Detector):
     
     extension_name = 'Crossbill Detector'
     
-    def __init__(self, sample_rate, listener, settings):
-        super().__init__(settings, sample_rate, listener)
+    def __init__(
+            self, sample_rate, listener, settings, decimate=False,
+            dtype='float64'):
+        super().__init__(settings, sample_rate, listener, decimate, dtype)
+        
+        
+
+# RECR: New class for running several detectors in one pass
+class MultiDetector:
+    
+    """
+    Runs detectors with several different settings on one audio channel.
+    
+    A `MultiDetector` behaves like a set of `_Detector` objects, one for
+    each of a list of settings, that are run on the same input, but
+    converts the input once and shares the outputs of signal processing
+    stages that are configured identically in more than one of the
+    detectors. For example, detectors whose settings differ only in
+    their thresholds or durations share all of their signal processing.
+    When decimating, detectors with the same decimation factor share
+    decimation. Each detector notifies its own listener of the clips it
+    detects.
+    
+    Like the `_Detector` class, this class has a `detect` method that
+    can be called repeatedly with consecutive sample arrays, and a
+    `complete_detection` method that should be called after the final
+    call to `detect`.
+    """
+    
+    
+    def __init__(
+            self, settings, sample_rate, listeners, decimate=False,
+            dtype='float64'):
+        
+        if len(settings) != len(listeners):
+            raise ValueError(
+                'Number of settings and number of listeners differ.')
+            
+        detectors = [
+            _Detector(s, sample_rate, listener, decimate, dtype)
+            for s, listener in zip(settings, listeners)]
+        
+        # Group detectors by decimation factor, preserving their order.
+        groups = {}
+        for detector in detectors:
+            factor = detector.decimation_factor
+            groups.setdefault(factor, []).append(detector)
+        
+        self._groups = [_DetectorGroup(g) for g in groups.values()]
+        
+        self._detectors = detectors
+        
+        
+    @property
+    def detectors(self):
+        return tuple(self._detectors)
+    
+    
+    def detect(self, samples):
+        for group in self._groups:
+            group.detect(samples)
+            
+            
+    def process_segment_crossings(self, segment_crossings):
+        
+        """
+        Finds clips in threshold crossings found by `get_segment_crossings`.
+        
+        This method is an alternative to the `detect` method, for
+        detecting in segments of a recording in parallel. For each
+        segment of the recording in turn, call this method with the
+        crossings found by `get_segment_crossings` in the segment, and
+        then call `complete_detection`. The detectors' listeners are
+        notified of the same clips as when the whole recording is
+        passed to `detect`, in the same order.
+        """
+        
+        for detector, (indices, rises, num_samples_processed) in \
+                zip(self._detectors, segment_crossings):
+            detector._process_crossings((indices, rises))
+            detector._num_samples_processed = num_samples_processed
+            
+            
+    def complete_detection(self):
+        for group in self._groups:
+            group.complete_detection()
+            
+            
+def get_segment_crossings(
+        settings, sample_rate, samples, start_index, end_index, block_size,
+        decimate=False, dtype='float64'):
+    
+    """
+    Finds the threshold crossings of a `MultiDetector` in one segment of
+    a recording.
+    
+    `samples` is the recording, as a one-dimensional array or an object
+    that can be sliced like one (such as a channel of a memory-mapped
+    file), and the segment is `samples[start_index:end_index]`. The
+    crossings are exactly those that a `MultiDetector` with the given
+    settings finds in the segment when `detect` is called with
+    consecutive blocks of `block_size` samples of the recording,
+    provided that `start_index` is a multiple of `block_size`.
+    
+    The crossings of each detector depend only on the samples of a
+    bounded interval preceding them, so segments can be processed
+    independently, in parallel, and then passed in order to
+    `MultiDetector.process_segment_crossings` to find clips. This
+    function runs only the detectors' decimators and signal processors;
+    their series processors, which are stateful but fast, run only in
+    `process_segment_crossings`.
+    
+    Returns a list containing, for each detector, an array of crossing
+    indices at the detector's processing rate, a corresponding array of
+    booleans that are `True` for rises and `False` for falls, and the
+    number of samples at the processing rate through the end of the
+    segment.
+    """
+    
+    detector = MultiDetector(
+        settings, sample_rate, [None] * len(settings), decimate, dtype)
+    detectors = detector.detectors
+    
+    _check_segment_block_size(detectors, block_size)
+    
+    # Before the segment, run the detectors on two blocks to bring their
+    # state to what it would be after processing all preceding samples:
+    # the first block fills the decimators, and the second, which is
+    # exactly the block that precedes the segment when detecting in
+    # blocks, fills the signal processors. The first block is extended
+    # to start at a multiple of every decimation factor, so that each
+    # detector processes the same decimated samples as it would after
+    # processing all preceding samples. Its crossings are discarded.
+    factor = int(np.lcm.reduce([d.decimation_factor for d in detectors]))
+    priming_start_index = max(start_index - 2 * block_size, 0)
+    priming_start_index -= priming_start_index % factor
+    block_starts = [priming_start_index]
+    if start_index - block_size > priming_start_index:
+        block_starts.append(start_index - block_size)
+    if start_index > priming_start_index:
+        block_starts.append(start_index)
+    num_priming_blocks = len(block_starts) - 1
+    block_starts.extend(range(start_index + block_size, end_index, block_size))
+    block_ends = block_starts[1:] + [end_index]
+    
+    for i, (start, end) in enumerate(zip(block_starts, block_ends)):
+        
+        # Record crossings from the start, so that none are passed to the
+        # detectors' series processors, and forget those of the priming
+        # blocks when the segment starts.
+        if i == 0 or i == num_priming_blocks:
+            for d in detectors:
+                d._recorded_crossings = []
+                
+        detector.detect(np.asarray(samples[start:end]))
+        
+    segment_crossings = []
+    
+    for d in detectors:
+        
+        # Convert indices relative to the start of priming to indices in
+        # the recording.
+        offset = priming_start_index // d.decimation_factor
+        
+        crossings = d._recorded_crossings
+        if len(crossings) == 0:
+            crossings = [(np.zeros(0, dtype='int64'), np.zeros(0, dtype='bool'))]
+        indices = np.concatenate([c[0] for c in crossings]) + offset
+        rises = np.concatenate([c[1] for c in crossings])
+        
+        segment_crossings.append(
+            (indices, rises, d._num_samples_processed + offset))
+        
+    return segment_crossings
+            
+            
+def _check_segment_block_size(detectors, block_size):
+    
+    """
+    Checks that blocks of `block_size` samples are long enough for the
+    two priming blocks of `get_segment_crossings` to bring detectors to
+    the state they would be in after processing all preceding samples.
+    
+    The first block must hold the samples a detector's decimator keeps
+    between calls, and the second, decimated, must hold the samples its
+    signal processor keeps (its latency plus two).
+    """
+    
+    for d in detectors:
+        
+        if d._decimator is None:
+            min_size = 0
+        else:
+            min_size = len(d._decimator._recent_samples)
+            
+        min_size = max(min_size,
+            (d._signal_processor.latency + 2) * d.decimation_factor)
+        
+        if block_size < min_size:
+            raise ValueError(
+                'Block size {} too small for detecting in segments: must '
+                'be at least {}.'.format(block_size, min_size))
+            
+            
+class _DetectorGroup:
+    
+    """
+    Detectors with the same input and decimation, run by a `MultiDetector`.
+    
+    The group decimates its input once, using the decimator of its
+    first detector, and then runs the detectors' signal processors,
+    computing each distinct sequence of processing stages only once.
+    """
+    
+    
+    def __init__(self, detectors):
+        
+        self._detectors = detectors
+        self._decimator = detectors[0]._decimator
+        
+        self._latency = max(d._signal_processor.latency for d in detectors)
+        
+        self._dtype = detectors[0].dtype
+        
+        self._num_samples_processed = 0
+        self._recent_samples = np.array([], dtype=self._dtype)
+        
+        
+    def detect(self, samples):
+        
+        if self._decimator is not None:
+            samples = self._decimator.process(samples)
+            
+        # As in `_Detector.detect`, prepend samples saved from the
+        # previous call. We save enough samples for the detector with
+        # the largest latency, so that detectors with smaller latencies
+        # recompute some ratios, which we discard below.
+        augmented_samples = np.concatenate(
+            (self._recent_samples, samples)).astype(self._dtype, copy=False)
+        start_index = self._num_samples_processed - len(self._recent_samples)
+        
+        # outputs of processing stages, keyed by the sequence of stage
+        # keys that produced them
+        outputs = {}
+        
+        for detector in self._detectors:
+            
+            latency = detector._signal_processor.latency
+            
+            if len(augmented_samples) > latency:
+                # have enough samples to fill this detector's pipeline
+                
+                ratios = self._process(detector, augmented_samples, outputs)
+                offset = start_index + latency
+                
+                # Discard any ratios that precede the last one computed
+                # for this detector in the previous call.
+                num_repeated = self._num_samples_processed - 2 - offset
+                if num_repeated > 0:
+                    ratios = ratios[num_repeated:]
+                    offset += num_repeated
+                
+                detector._process_ratios(ratios, offset)
+                
+        self._recent_samples = augmented_samples[-(self._latency + 2):]
+        
+        self._num_samples_processed += len(samples)
+        
+        for detector in self._detectors:
+            detector._num_samples_processed = self._num_samples_processed
+            
+            
+    def _process(self, detector, samples, outputs):
+        
+        x = samples
+        key = ()
+        
+        for stage_key, processor in detector._signal_processor_stages:
+            
+            key += (stage_key,)
+            
+            # Note that `_Divider.process` modifies its input in place,
+            # replacing zeros with small values. That is harmless when
+            # its input is shared, since all dividers make the same
+            # modification.
+            if key not in outputs:
+                outputs[key] = processor.process(x)
+                
+            x = outputs[key]
+            
+        return x
+    
+    
+    def complete_detection(self):
+        for detector in self._detectors:
+            detector.complete_detection()
+            
+            
+# RECR: Caching of signal processor designs. Designs are cached in
+# memory, and optionally also on disk, so that they can be shared by
+# separate runs and by the worker processes of a batch run.
+
+
+_filter_cache_dir_path = None
+"""path of on-disk filter cache directory, or `None` if disabled."""
+
+
+def get_filter_cache_dir():
+    """Returns the directory set by `set_filter_cache_dir`."""
+    return _filter_cache_dir_path
+
+
+def set_filter_cache_dir(dir_path):
+    
+    """
+    Sets the directory in which designed filters are cached on disk.
+    
+    Filters are cached only in memory if `dir_path` is `None`, which is
+    the default. The directory is created if it does not exist.
+    """
+    
+    global _filter_cache_dir_path
+    
+    if dir_path is not None:
+        os.makedirs(dir_path, exist_ok=True)
+        
+    _filter_cache_dir_path = dir_path
+    
+    
+@functools.lru_cache(maxsize=_DESIGN_CACHE_SIZE)
+def _design_signal_processor(
+        filter_duration, f0, f1, bw, integration_time, ratio_delay,
+        sample_rate):
+    
+    """
+    Designs a detector signal processor.
+    
+    Returns the filter coefficients, integration length, and ratio
+    delay of a signal processor for the specified settings and sample
+    rate.
+    """
+    
+    # We use a filter length that is proportional to the sample rate,
+    # and that is 100 when the sample rate is 22050 hertz. (The original
+    # Old Bird detectors were intended for 22050 hertz input only, and
+    # their filters had length 100.)
+    #
+    # Varying the filter length in this way yields filters with very
+    # similar frequency responses at different sample rates. See the
+    # Jupyter notebook
+    # "Old Bird Detector Filter at Different Sample Rates.ipynb" in
+    # the "HaroldMills/Vesper-Tseep-Thrush" GitHub repository for a
+    # demonstration of this for the Tseep and Thrush detector filters..
+    filter_length = int(round(filter_duration * sample_rate))
+    
+    coefficients = _load_or_design_filter(
+        'bandpass', (filter_length, f0, f1, bw, sample_rate),
+        lambda: _design_filter(filter_length, f0, f1, bw, sample_rate))
+    
+    integration_length = int(round(integration_time * sample_rate))
+    
+    # We use `math.floor` here rather than `round` since the Simulink
+    # .mdl files we have access to suggest that the original Old Bird
+    # detectors use MATLAB's `fix`  function, which rounds towards zero.
+    delay = math.floor(ratio_delay * sample_rate)
+    
+    return (coefficients, integration_length, delay)
+    
+    
+def _design_filter(filter_length, f0, f1, bw, sample_rate):
+    fs2 = sample_rate / 2
+    bands = np.array([0, f0 - bw, f0, f1, f1 + bw, fs2]) / fs2
+    desired = np.array([0, 0, 1, 1, 0, 0])
+    return _firls(filter_length, bands, desired)
+
+
+def _load_or_design_filter(kind, key, design):
+    
+    """
+    Gets filter coefficients from the on-disk cache, if it is enabled.
+    
+    If the coefficients for `key` are not in the cache, this function
+    designs them by calling `design` and adds them to the cache. The
+    returned coefficients are read-only, since they may be shared.
+    """
+    
+    dir_path = _filter_cache_dir_path
+    
+    if dir_path is None:
+        coefficients = design()
         
+    else:
         
+        # `repr` represents floats exactly, so equal keys yield equal
+        # digests only for equal settings.
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        path = os.path.join(dir_path, '{}-{}.npy'.format(kind, digest))
+        
+        try:
+            coefficients = np.load(path)
+            
+        except (OSError, ValueError):
+            
+            coefficients = design()
+            
+            # Write to a temporary file and then rename it, so that other
+            # processes sharing the cache never see a partial file.
+            temp_path = '{}.{}.tmp'.format(path, os.getpid())
+            with open(temp_path, 'wb') as file_:
+                np.save(file_, coefficients)
+            os.replace(temp_path, path)
+            
+    coefficients.flags.writeable = False
+    
+    return coefficients
+
+
 def _firls(numtaps, bands, desired):
     
     """
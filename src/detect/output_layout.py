@@ -0,0 +1,111 @@
+'''
+output_layout.py
+
+Where a run of the detector saves its output.
+
+Each run saves everything in its own run directory, named for the time
+the run started:
+
+    <root>/run-20180412-213000/
+        manifest.csv
+        detections-type2/
+            00/ ... ff/        clip files, sharded by a hash of their names
+        detections-type6/
+            ...
+
+A clip file's shard is chosen from a hash of its name, so clips are
+spread evenly over the shards of a detector's directory and no single
+directory gets too many files: with the default 256 shards, a directory
+holds about 4000 files only after a million clips. A shard directory is
+made when the first file is saved in it, so runs that save few clips or
+none (e.g. those that only list detections in a manifest) don't make
+hundreds of empty directories. Each process remembers the shards it has
+made, so it checks for each directory only once.
+'''
+
+import hashlib
+import os
+from datetime import datetime
+
+
+# number of hexadecimal digits in shard directory names, so that
+# a detector's directory has 16 ** _SHARD_DIGITS shards
+_SHARD_DIGITS = 2
+
+
+class OutputLayout:
+    '''
+    The directories of one run. The run directory and the detectors'
+    directories are made when the layout is created, and shards when
+    files are first saved in them (see get_file_path()). Layouts can be
+    pickled and sent to worker processes, which then save clips in the
+    same directories as the main process.
+
+    Attributes:
+        - run_dir: the run directory
+        - manifest_path: the path of the run's manifest in run_dir
+    '''
+
+    def __init__(self, root_dir, detector_names, shard_digits = _SHARD_DIGITS):
+        '''
+        Makes a new run directory in root_dir, with a directory for each
+        of detector_names (see get_detector_dir())
+        '''
+
+        self.run_dir = _make_run_dir(root_dir)
+        self.manifest_path = os.path.join(self.run_dir, 'manifest.csv')
+        self._shard_digits = shard_digits
+
+        # shard directories known to exist
+        self._shard_dirs = set()
+
+        for name in detector_names:
+            os.makedirs(self.get_detector_dir(name))
+
+    def get_detector_dir(self, name):
+        '''Returns the directory for the output of the detector with the
+        given name: "detections-<name>", or "detections" if name is None'''
+        dir_name = 'detections-' + name if name else 'detections'
+        return os.path.join(self.run_dir, dir_name)
+
+    def get_file_path(self, detector_name, file_name):
+        '''Returns the path at which to save the file file_name output by
+        the detector with the given name, in the shard for file_name,
+        making the shard's directory if it hasn't been made yet'''
+
+        digest = hashlib.sha1(file_name.encode('utf-8')).hexdigest()
+        shard_dir = os.path.join(self.get_detector_dir(detector_name),
+                                 digest[:self._shard_digits])
+
+        if shard_dir not in self._shard_dirs:
+            # Other processes may be making it too
+            os.makedirs(shard_dir, exist_ok=True)
+            self._shard_dirs.add(shard_dir)
+
+        return os.path.join(shard_dir, file_name)
+
+
+def clip_file_name(recording_name, start, sample_rate, extension = '.wav'):
+    '''Returns the name of the file for a clip starting at sample `start`,
+    indicating detection origin and start in ms: a .wav file by default,
+    or a file with another extension, such as the clip's spectrogram'''
+    start_ms = int(1000 * start/sample_rate)
+    return "{}_{}ms{}".format(recording_name, start_ms, extension)
+
+
+def _make_run_dir(root_dir):
+    '''Makes and returns a new directory in root_dir named for the current
+    time, with a number appended if runs started in the same second'''
+
+    base_name = os.path.join(
+        root_dir, datetime.now().strftime('run-%Y%m%d-%H%M%S'))
+
+    dir_name = base_name
+    increment = 2
+    while True:
+        try:
+            os.makedirs(dir_name)
+            return dir_name
+        except FileExistsError:
+            dir_name = '{}-{}'.format(base_name, increment)
+            increment += 1
@@ -0,0 +1,261 @@
+'''
+recording_viewer.py
+
+A Python3 GUI for viewing the spectrogram of a whole recording, such as
+a night's recording, with its detections marked on it.
+
+Usage:
+$ python recording_viewer.py <recording.wav>
+$ python recording_viewer.py <recording.wav> --manifest <manifest.csv>
+
+The spectrogram is shown from the recording's spectrogram pyramid (see
+spectrogram_pyramid.py), which is built the first time a recording is
+viewed. Only the tiles of the pyramid in view are read, at the
+resolution of the screen, so a whole night can be panned and zoomed as
+quickly as a single clip. The detections listed for the recording in
+a manifest (see clip_store.py) are outlined, colored by the settings
+that detected them.
+
+Keys:
+    left, right    pan by half the view
+    +, -           zoom in and out (so does the mouse wheel, at the mouse)
+    n, p           zoom in on the next or previous detection
+    0              show the whole recording
+    q              quit
+'''
+
+import argparse
+import logging
+import os
+
+import numpy as np
+
+from matplotlib.collections import PolyCollection
+from matplotlib.figure import Figure
+from matplotlib.ticker import FuncFormatter
+
+from clip_store import read_manifest
+from spectrogram_pyramid import get_pyramid, DEFAULT_PYRAMID_DIR
+
+
+# Colors of detection outlines, in order of settings names
+_DETECTION_COLORS = ('tab:red', 'tab:blue', 'tab:orange', 'tab:green',
+                     'tab:purple', 'tab:cyan')
+
+# Factor by which each zoom step changes the duration in view
+_ZOOM_FACTOR = 2
+
+# Duration shown around a detection by the n and p keys, in seconds
+_DETECTION_VIEW_DURATION = 2
+
+# Shortest duration that can be viewed, in seconds
+_MIN_VIEW_DURATION = .1
+
+
+class RecordingView:
+    '''
+    The spectrogram of a recording, with its detections, in a figure,
+    showing the part of the recording from start_time to end_time. The
+    figure has a single image and a single collection of detection
+    outlines, which are updated whenever the view changes.
+
+    detections is a list of (start index, length, settings name) tuples
+    '''
+
+    def __init__(self, figure, pyramid, detections = ()):
+
+        self.figure = figure
+        self.pyramid = pyramid
+
+        self.ax = figure.add_subplot(111)
+        self.ax.set_ylabel('Frequency (Hz)')
+        self.ax.xaxis.set_major_formatter(FuncFormatter(_format_time))
+        figure.subplots_adjust(left=.08, right=.99, bottom=.08, top=.98)
+
+        self.image = None
+
+        # Detections as times in seconds, in order of their centers
+        detections = sorted(detections, key=lambda d: d[0] + d[1] / 2)
+        sample_rate = pyramid.sample_rate
+        self._starts = np.array([d[0] / sample_rate for d in detections])
+        self._ends = np.array([(d[0] + d[1]) / sample_rate for d in detections])
+        names = sorted({d[2] or '' for d in detections})
+        self._colors = [
+            _DETECTION_COLORS[names.index(d[2] or '') % len(_DETECTION_COLORS)]
+            for d in detections]
+
+        self.outlines = PolyCollection(
+            [], facecolors='none', linewidths=1, zorder=2)
+        self.ax.add_collection(self.outlines)
+
+        self.start_time = 0
+        self.end_time = pyramid.duration
+
+    def show(self, start_time = None, end_time = None):
+        '''Shows the part of the recording between two times in seconds,
+        by default the part in view, kept within the recording'''
+
+        if start_time is None:
+            start_time, end_time = (self.start_time, self.end_time)
+
+        duration = min(max(end_time - start_time, _MIN_VIEW_DURATION),
+                       self.pyramid.duration)
+        start_time = min(max(start_time, 0), self.pyramid.duration - duration)
+        self.start_time = start_time
+        self.end_time = start_time + duration
+
+        # One column of the spectrogram for each pixel of the axes
+        width = self.ax.get_window_extent().width
+        spectrum, freqs, times = self.pyramid.get_view(
+            self.start_time, self.end_time, max(int(width), 1))
+        extent = (times[0], times[1], freqs[0], freqs[-1])
+
+        if self.image is None:
+            self.image = self.ax.imshow(spectrum, cmap='gray_r',
+                aspect='auto', origin='lower', interpolation='nearest',
+                extent=extent, vmin=self.pyramid.vmin, vmax=self.pyramid.vmax)
+        else:
+            self.image.set_data(spectrum)
+            self.image.set_extent(extent)
+
+        self._show_detections(freqs[0], freqs[-1])
+
+        self.ax.set_xlim(self.start_time, self.end_time)
+        self.ax.set_ylim(freqs[0], freqs[-1])
+        self.figure.canvas.draw_idle()
+
+    def _show_detections(self, min_freq, max_freq):
+        '''Outlines the detections in view'''
+
+        in_view = np.nonzero((self._starts < self.end_time) &
+                             (self._ends > self.start_time))[0]
+
+        self.outlines.set_verts([
+            ((self._starts[i], min_freq), (self._ends[i], min_freq),
+             (self._ends[i], max_freq), (self._starts[i], max_freq))
+            for i in in_view])
+        self.outlines.set_edgecolors([self._colors[i] for i in in_view])
+
+    def pan(self, fraction):
+        '''Moves the view by a fraction of its duration, forward if the
+        fraction is positive'''
+        shift = fraction * (self.end_time - self.start_time)
+        self.show(self.start_time + shift, self.end_time + shift)
+
+    def zoom(self, factor, center = None):
+        '''Divides the duration in view by factor, keeping the time center,
+        by default the middle of the view, in the same place'''
+        if center is None:
+            center = (self.start_time + self.end_time) / 2
+        self.show(center - (center - self.start_time) / factor,
+                  center + (self.end_time - center) / factor)
+
+    def show_detection(self, direction):
+        '''Centers the view on the next detection after the middle of the
+        view, or the previous one before it if direction is negative'''
+
+        middle = (self.start_time + self.end_time) / 2
+        centers = (self._starts + self._ends) / 2
+
+        if direction > 0:
+            i = np.searchsorted(centers, middle + 1e-6, side='left')
+        else:
+            i = np.searchsorted(centers, middle - 1e-6, side='left') - 1
+
+        if 0 <= i < len(centers):
+            half = _DETECTION_VIEW_DURATION / 2
+            self.show(centers[i] - half, centers[i] + half)
+
+    def on_key(self, event):
+        '''Handles keypresses (see the module docstring)'''
+        if event.key == 'right':
+            self.pan(.5)
+        elif event.key == 'left':
+            self.pan(-.5)
+        elif event.key in ('+', '='):
+            self.zoom(_ZOOM_FACTOR)
+        elif event.key == '-':
+            self.zoom(1 / _ZOOM_FACTOR)
+        elif event.key == 'n':
+            self.show_detection(1)
+        elif event.key == 'p':
+            self.show_detection(-1)
+        elif event.key == '0':
+            self.show(0, self.pyramid.duration)
+
+    def on_scroll(self, event):
+        '''Zooms in or out at the mouse'''
+        if event.inaxes is self.ax:
+            factor = _ZOOM_FACTOR if event.button == 'up' else 1 / _ZOOM_FACTOR
+            self.zoom(factor, event.xdata)
+
+
+def _format_time(seconds, position = None):
+    '''Formats a time in seconds as h:mm:ss.s'''
+    minutes, seconds = divmod(max(seconds, 0), 60)
+    hours, minutes = divmod(int(minutes), 60)
+    return '{}:{:02d}:{:04.1f}'.format(hours, minutes, seconds)
+
+
+def get_detections(manifest_path, recording_path):
+    '''Returns the detections a manifest lists for a recording, as (start
+    index, length, settings name) tuples'''
+    recording_path = os.path.abspath(recording_path)
+    return [(clip.start_index, clip.length, clip.settings_name)
+            for clip in read_manifest(manifest_path)
+            if clip.recording_path == recording_path]
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description='View the spectrogram of a whole recording, with its \
+            detections.', add_help=True)
+    parser.add_argument('recording', help='a .wav file')
+    parser.add_argument('--manifest', metavar='PATH', dest='manifest',
+        help='detection manifest listing detections to show')
+    parser.add_argument('--pyramid-dir', metavar='DIR', dest='pyramid_dir',
+        default=DEFAULT_PYRAMID_DIR,
+        help='directory of spectrogram pyramids (default: {})'.format(
+            DEFAULT_PYRAMID_DIR))
+    input = vars(parser.parse_args())
+
+    logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
+
+    pyramid = get_pyramid(input['recording'], input['pyramid_dir'])
+    detections = get_detections(input['manifest'], input['recording']) \
+        if input['manifest'] else []
+
+    # Imported here, so that RecordingView can be used without a display
+    import tkinter as Tk
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+    root = Tk.Tk()
+    root.wm_title("Recording viewer: {}".format(
+        os.path.basename(input['recording'])))
+    root.geometry("1200x500")
+
+    figure = Figure(dpi=100)
+    canvas = FigureCanvasTkAgg(figure, master=root)
+    canvas.get_tk_widget().pack(side=Tk.TOP, fill=Tk.BOTH, expand=1)
+
+    view = RecordingView(figure, pyramid, detections)
+
+    def on_key(event):
+        if event.key == 'q':
+            root.quit()
+        else:
+            view.on_key(event)
+
+    canvas.mpl_connect('key_press_event', on_key)
+    canvas.mpl_connect('scroll_event', view.on_scroll)
+
+    # The number of columns to show depends on the size of the window
+    canvas.mpl_connect('resize_event', lambda event: view.show())
+
+    view.show()
+    root.mainloop()
+
+
+if __name__ == '__main__':
+    main()
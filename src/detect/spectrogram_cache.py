@@ -0,0 +1,202 @@
+'''
+spectrogram_cache.py
+
+An on-disk cache of spectrograms, shared by everything that shows or
+saves spectrograms of clips: the review application, bulk exports (see
+export_spectrograms.py), and analysis scripts.
+
+Spectrograms are keyed by a hash of the clip's samples and sample rate
+and of the settings they are computed with (see get_key()), so a clip
+has the same key whether it is read from a clip file, a clip archive or
+its recording, and a spectrogram is never reused for other settings.
+
+Each spectrogram is kept in its own .npz file, with its values stored
+as 16-bit floats. These take a quarter of the space of 64-bit ones, and
+are within about 0.03 dB of them for the levels of 16-bit recordings.
+When the files take more than the cache's size budget, the least
+recently used ones are deleted.
+'''
+
+import hashlib
+import logging
+import os
+import tempfile
+
+import numpy as np
+
+from spectrogram_stft import compute_spectrograms
+
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.expanduser('~'), '.cache', 'crossbill-detect', 'spectrograms')
+
+DEFAULT_MAX_SIZE = 2 ** 30
+
+# Changed whenever the spectrograms computed for the same key change, so
+# that spectrograms cached before are not used
+_KEY_VERSION = 2
+
+_FILE_NAME_EXTENSION = '.npz'
+
+# Fraction of the size budget that eviction brings the cache down to, so
+# that it doesn't have to evict again as soon as another file is added
+_EVICTION_TARGET = .9
+
+
+def get_key(samples, sample_rate, settings):
+    '''Returns the key of the spectrogram of a clip computed with
+    compute_spectrograms() with the given keyword arguments'''
+
+    samples = np.ascontiguousarray(samples)
+
+    digest = hashlib.sha1()
+    digest.update(repr((_KEY_VERSION, float(sample_rate),
+        samples.dtype.str, sorted(settings.items()))).encode('utf-8'))
+    digest.update(memoryview(samples).cast('B'))
+
+    return digest.hexdigest()
+
+
+class SpectrogramCache:
+    '''
+    Spectrograms cached in a directory, made if it doesn't exist yet.
+    Several processes can use the same directory at once.
+
+        cache = SpectrogramCache()
+        spectrum, freqs, times, limits = cache.get_spectrogram(
+            samples, sample_rate, DEFAULT_SETTINGS)
+    '''
+
+    def __init__(self, dir_path = DEFAULT_CACHE_DIR,
+        max_size = DEFAULT_MAX_SIZE):
+
+        self.dir_path = dir_path
+        self.max_size = max_size
+        os.makedirs(dir_path, exist_ok=True)
+
+        # An estimate, kept by this object, of the size of the cache. It
+        # misses files added by other processes, but is corrected whenever
+        # the cache is scanned to evict files.
+        self._size = sum(size for _, _, size in self._scan())
+
+    def _get_path(self, key):
+        return os.path.join(self.dir_path, key[:2], key + _FILE_NAME_EXTENSION)
+
+    def get(self, key):
+        '''Returns the spectrogram cached with a key, as a (spectrum,
+        freqs, times, limits) tuple like compute_spectrograms() returns
+        with return_limits=True, or None if there isn't one. A file that
+        can't be read (e.g. one damaged on disk) is deleted, and counts as
+        a miss, so that the spectrogram is computed and cached again'''
+
+        path = self._get_path(key)
+
+        try:
+            with np.load(path) as arrays:
+                spectrogram = (arrays['spectrum'].astype('float32'),
+                               arrays['freqs'], arrays['times'],
+                               arrays['limits'])
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning("Deleting unreadable spectrogram '{}': {}: {}".format(
+                path, type(e).__name__, e))
+            try:
+                os.remove(path)
+            except OSError:
+                pass # deleted by another process
+            return None
+
+        # The file's modification time is its last use (see _evict())
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        return spectrogram
+
+    def put(self, key, spectrogram):
+        '''Caches a (spectrum, freqs, times, limits) tuple with a key.
+        Returns the spectrogram as get() will return it, with its values
+        rounded to 16 bits, so that a spectrogram looks the same whether
+        it was just computed or read from the cache'''
+
+        (spectrum, freqs, times, limits) = spectrogram
+        spectrum = spectrum.astype('float16')
+
+        path = self._get_path(key)
+        dir_path = os.path.dirname(path)
+        os.makedirs(dir_path, exist_ok=True)
+
+        # Written to a temporary file first, so that other processes
+        # never read a partially written file
+        fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=dir_path)
+        try:
+            with os.fdopen(fd, 'wb') as file_:
+                np.savez(file_, spectrum=spectrum,
+                         freqs=freqs, times=times, limits=limits)
+            self._size += os.path.getsize(temp_path)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        if self._size > self.max_size:
+            self._evict()
+
+        return (spectrum.astype('float32'), freqs, times, limits)
+
+    def get_spectrogram(self, samples, sample_rate, settings):
+        '''Returns the spectrogram of a clip computed with
+        compute_spectrograms() with the given keyword arguments and its
+        limits (see get()), from the cache if it is there and otherwise
+        computing and caching it'''
+
+        key = get_key(samples, sample_rate, settings)
+
+        spectrogram = self.get(key)
+
+        if spectrogram is None:
+            spectrogram = self.put(key, compute_spectrograms(
+                samples, sample_rate, return_limits=True, **settings))
+
+        return spectrogram
+
+    def _scan(self):
+        '''Returns a (path, modification time, size) tuple for each file
+        in the cache'''
+
+        files = []
+
+        for shard in os.scandir(self.dir_path):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(_FILE_NAME_EXTENSION):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue # deleted by another process
+                    files.append((entry.path, stat.st_mtime, stat.st_size))
+
+        return files
+
+    def _evict(self):
+        '''Deletes the least recently used files until the cache is
+        within its size budget'''
+
+        files = sorted(self._scan(), key=lambda file_: file_[1])
+        self._size = sum(size for _, _, size in files)
+        target = self.max_size * _EVICTION_TARGET
+
+        for path, _, size in files:
+            if self._size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass # deleted by another process
+            self._size -= size
+
+        logging.info("Evicted spectrograms from '{}', leaving {} bytes".format(
+            self.dir_path, self._size))
@@ -0,0 +1,126 @@
+'''
+spectrogram_png.py
+
+Saving spectrograms as .png images without matplotlib.
+
+Saving a spectrogram through a matplotlib Figure draws the whole figure
+and encodes it as an RGBA image, which takes tens of milliseconds per
+clip. The images are just the spectrogram, gray scale and with no
+axes, so they can be made far more cheaply: spectrogram_to_image() maps
+a spectrogram (see spectrogram_stft.py) straight to 8-bit gray levels
+through a lookup table of matplotlib's 'gray_r' color map, and
+write_png() writes them as a gray scale .png file with zlib.
+'''
+
+import struct
+import zlib
+
+import numpy as np
+
+
+# matplotlib's 'gray_r' color map, as the 8-bit gray levels it maps each
+# of its 256 colors to when saving an image
+_GRAY_R = ((1 - np.linspace(0, 1, 256)) * 255).astype(np.uint8)
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# PNG row filter that stores each row as its difference from the row
+# above, which compresses spectrograms well since they are usually
+# stretched vertically
+_PNG_FILTER_UP = 2
+
+
+def spectrogram_to_image(spectrum, vmin=None, vmax=None, size=None):
+    '''
+    Maps a spectrogram to a gray scale image as matplotlib's imshow()
+    does with the 'gray_r' color map.
+
+    spectrum: a 2D array of frequencies by times, in dB, with frequency
+        increasing along the first axis
+    vmin, vmax: the values mapped to white and black, by default the
+        least and greatest finite values of the spectrogram
+    size: the (width, height) of the image in pixels. By default the image
+        has a pixel for each value of the spectrogram, and otherwise the
+        spectrogram is stretched to fill it.
+
+    Returns a 2D array of 8-bit gray levels, with the highest frequency
+    in the top row.
+    '''
+
+    spectrum = np.asarray(spectrum)
+
+    if vmin is None or vmax is None:
+        finite = spectrum[np.isfinite(spectrum)]
+        if vmin is None:
+            vmin = finite.min() if len(finite) != 0 else 0
+        if vmax is None:
+            vmax = finite.max() if len(finite) != 0 else 0
+
+    # Scale to color indices as matplotlib does. Silent bins, at -inf dB,
+    # come out white, as they do in matplotlib's images.
+    if vmax > vmin:
+        indices = np.subtract(spectrum, vmin, dtype='float64')
+        indices /= vmax - vmin
+        indices *= len(_GRAY_R)
+    else:
+        indices = np.zeros(spectrum.shape)
+    indices[np.isnan(indices)] = 0
+    np.clip(indices, 0, len(_GRAY_R) - 1, out=indices)
+
+    image = _GRAY_R[indices.astype(np.intp)[::-1]]
+
+    if size is not None:
+        (width, height) = size
+        rows = _get_pixel_indices(image.shape[0], height)
+        columns = _get_pixel_indices(image.shape[1], width)
+        image = image.take(rows, axis=0).take(columns, axis=1)
+
+    return image
+
+
+def _get_pixel_indices(num_values, num_pixels):
+    '''Returns the index of the value at the center of each of num_pixels
+    pixels that num_values values are stretched across'''
+    centers = (np.arange(num_pixels) + .5) * (num_values / num_pixels)
+    return np.minimum(centers.astype(np.intp), num_values - 1)
+
+
+def encode_png(image, compression=1):
+    '''
+    Returns the bytes of a .png file holding an image.
+
+    image: a 2D array of 8-bit gray levels, top row first
+    compression: the zlib compression level, from 0 (none) to 9 (most).
+        Spectrograms compressed at level 1 are only about a tenth larger
+        than at level 6, and are compressed about four times faster.
+    '''
+
+    image = np.asarray(image, dtype=np.uint8)
+    (height, width) = image.shape
+
+    # Each row is preceded by the number of the filter it is stored with
+    rows = np.empty((height, width + 1), dtype=np.uint8)
+    rows[:, 0] = _PNG_FILTER_UP
+    rows[0, 1:] = image[0]
+    np.subtract(image[1:], image[:-1], out=rows[1:, 1:])
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)
+    data = zlib.compress(rows.tobytes(), compression)
+
+    return b''.join((
+        _PNG_SIGNATURE,
+        _make_png_chunk(b'IHDR', header),
+        _make_png_chunk(b'IDAT', data),
+        _make_png_chunk(b'IEND', b'')))
+
+
+def _make_png_chunk(chunk_type, data):
+    crc = zlib.crc32(data, zlib.crc32(chunk_type))
+    return struct.pack('>I', len(data)) + chunk_type + data + \
+        struct.pack('>I', crc)
+
+
+def write_png(path, image, compression=1):
+    '''Writes an image to a .png file (see encode_png())'''
+    with open(path, 'wb') as file_:
+        file_.write(encode_png(image, compression))
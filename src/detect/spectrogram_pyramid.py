@@ -0,0 +1,362 @@
+'''
+spectrogram_pyramid.py
+
+Multi-resolution spectrograms of whole recordings, for viewing a whole
+night's recording at once and zooming in on any part of it (see
+recording_viewer.py).
+
+A recording's spectrogram is too large to compute or show whenever it
+is viewed, so it is computed once and saved as a pyramid of levels:
+
+    <root>/<recording name>-<hash of its path>/
+        pyramid.json       what the pyramid was made from, and its shape
+        level-0/           the spectrogram, one column per frame
+            000000.npy     tiles of up to tile_frames columns each
+            000001.npy
+            ...
+        level-1/           level 0 with half as many columns
+        ...                and so on, up to a level of a single tile
+
+Each column of a level is the maximum of two columns of the level below
+it, so that short calls still show when a whole night is viewed at
+once. A view of any part of a recording needs only the tiles of the
+level whose columns are about as wide as the view's pixels, so the
+time it takes to show a view doesn't depend on the recording's length.
+
+Usage, to build the pyramids of recordings before viewing them:
+$ python spectrogram_pyramid.py <recording.wav> <directory-of-wav-files/> ...
+'''
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from ntpath import basename
+
+import numpy as np
+
+from audio_file_utils import read_wave_file_mmap
+from file_discovery import find_files
+from ledger import get_file_stamp
+from spectrogram_stft import compute_spectrograms
+
+
+DEFAULT_PYRAMID_DIR = os.path.join(
+    os.path.expanduser('~'), '.cache', 'crossbill-detect', 'pyramids')
+
+# Settings for compute_spectrograms(). Frames don't overlap, which keeps
+# the pyramid of an 8-hour recording at 22050 Hz to about 1.2 GB.
+PYRAMID_SETTINGS = dict(nfft=512, noverlap=0, freq_range=(0, 10000))
+
+DEFAULT_TILE_FRAMES = 1024
+
+_METADATA_FILE_NAME = 'pyramid.json'
+_METADATA_VERSION = 1
+
+# Number of level 0 tiles computed at a time
+_CHUNK_TILES = 16
+
+# Percentiles of level 0 values shown as white and black by default
+_DISPLAY_PERCENTILES = (2, 99.9)
+
+# Every _DISPLAY_SAMPLING-th column of level 0 is used to find them
+_DISPLAY_SAMPLING = 16
+
+# Number of tiles a SpectrogramPyramid keeps in memory
+_MAX_LOADED_TILES = 64
+
+
+def get_pyramid_dir(recording_path, root_dir = DEFAULT_PYRAMID_DIR):
+    '''Returns the directory of a recording's pyramid in root_dir'''
+    recording_path = os.path.abspath(recording_path)
+    name = os.path.splitext(basename(recording_path))[0]
+    digest = hashlib.sha1(recording_path.encode('utf-8')).hexdigest()
+    return os.path.join(root_dir, '{}-{}'.format(name, digest[:8]))
+
+
+def get_pyramid(recording_path, root_dir = DEFAULT_PYRAMID_DIR,
+    settings = PYRAMID_SETTINGS, tile_frames = DEFAULT_TILE_FRAMES):
+    '''Returns the SpectrogramPyramid of a recording in root_dir, building
+    it first if it hasn't been built with the given settings, or if the
+    recording has changed since'''
+
+    dir_path = get_pyramid_dir(recording_path, root_dir)
+
+    try:
+        pyramid = SpectrogramPyramid(dir_path)
+    except (OSError, ValueError, KeyError):
+        pyramid = None
+
+    if pyramid is None or not pyramid.is_current(settings, tile_frames):
+        build_pyramid(recording_path, dir_path, settings, tile_frames)
+        pyramid = SpectrogramPyramid(dir_path)
+
+    return pyramid
+
+
+def build_pyramid(recording_path, dir_path, settings = PYRAMID_SETTINGS,
+    tile_frames = DEFAULT_TILE_FRAMES):
+    '''
+    Builds the pyramid of the first channel of a recording in dir_path,
+    replacing any pyramid already there. Samples are read and spectrograms
+    computed a few tiles at a time, so recordings of any length can be
+    processed in little memory.
+    '''
+
+    file_stamp = get_file_stamp(recording_path)
+    (samples, sample_rate) = read_wave_file_mmap(recording_path)
+    channel = samples[0]
+    length = len(channel)
+
+    nfft = settings['nfft']
+    step = nfft - settings['noverlap']
+    num_frames = (length - nfft) // step + 1 if length >= nfft else 1
+
+    # Removed first, so a pyramid is never left half old and half new
+    metadata_path = os.path.join(dir_path, _METADATA_FILE_NAME)
+    if os.path.exists(metadata_path):
+        os.remove(metadata_path)
+
+    logging.info("Building spectrogram pyramid of '{}' in '{}'".format(
+        recording_path, dir_path))
+
+    # Level 0, computed a chunk of tiles at a time, each chunk from just
+    # the samples of its frames
+    _make_level_dir(dir_path, 0)
+    chunk_frames = tile_frames * _CHUNK_TILES
+    display_values = []
+
+    for first_frame in range(0, num_frames, chunk_frames):
+
+        end_frame = min(first_frame + chunk_frames, num_frames)
+        chunk_samples = np.asarray(channel[first_frame * step:
+            (end_frame - 1) * step + nfft])
+
+        spectrum, freqs, _ = compute_spectrograms(
+            chunk_samples, sample_rate, **settings)
+
+        for start in range(0, spectrum.shape[1], tile_frames):
+            _save_tile(dir_path, 0, (first_frame + start) // tile_frames,
+                spectrum[:, start:start + tile_frames])
+
+        display_values.append(
+            spectrum[:, ::_DISPLAY_SAMPLING].astype('float16').ravel())
+
+    # Higher levels, each tile from two tiles of the level below
+    level_frames = [num_frames]
+
+    while level_frames[-1] > tile_frames:
+
+        level = len(level_frames)
+        _make_level_dir(dir_path, level)
+        num_tiles = _num_tiles(level_frames[-1], tile_frames)
+
+        for index in range(0, num_tiles, 2):
+            below = [_load_tile(dir_path, level - 1, i)
+                     for i in range(index, min(index + 2, num_tiles))]
+            _save_tile(dir_path, level, index // 2,
+                _pool_columns(np.concatenate(below, axis=1)))
+
+        level_frames.append((level_frames[-1] + 1) // 2)
+
+    display_values = np.concatenate(display_values).astype('float32')
+    display_values = display_values[np.isfinite(display_values)]
+    if len(display_values):
+        vmin, vmax = np.percentile(display_values, _DISPLAY_PERCENTILES)
+    else:
+        vmin, vmax = (0, 0)
+
+    metadata = dict(
+        version=_METADATA_VERSION,
+        recording_path=os.path.abspath(recording_path),
+        file_stamp=list(file_stamp),
+        sample_rate=sample_rate,
+        length=length,
+        settings=settings,
+        step=step,
+        freqs=freqs.tolist(),
+        tile_frames=tile_frames,
+        level_frames=level_frames,
+        vmin=float(vmin),
+        vmax=float(vmax))
+
+    # Written last, and renamed into place, so that a pyramid with
+    # metadata is always complete
+    temp_path = metadata_path + '.tmp'
+    with open(temp_path, 'w') as file_:
+        json.dump(metadata, file_, indent=1)
+    os.replace(temp_path, metadata_path)
+
+
+def _make_level_dir(dir_path, level):
+    os.makedirs(os.path.join(dir_path, 'level-{}'.format(level)),
+                exist_ok=True)
+
+
+def _get_tile_path(dir_path, level, index):
+    return os.path.join(
+        dir_path, 'level-{}'.format(level), '{:06d}.npy'.format(index))
+
+
+def _save_tile(dir_path, level, index, tile):
+    np.save(_get_tile_path(dir_path, level, index), tile.astype('float16'))
+
+
+def _load_tile(dir_path, level, index):
+    return np.load(_get_tile_path(dir_path, level, index))
+
+
+def _num_tiles(num_frames, tile_frames):
+    return -(-num_frames // tile_frames)
+
+
+def _pool_columns(spectrum):
+    '''Returns the maxima of consecutive pairs of columns of a spectrogram,
+    the last column being its own maximum if there is an odd number'''
+    if spectrum.shape[1] % 2:
+        spectrum = np.concatenate((spectrum, spectrum[:, -1:]), axis=1)
+    return np.maximum(spectrum[:, 0::2], spectrum[:, 1::2])
+
+
+class SpectrogramPyramid:
+    '''
+    The pyramid of a recording, built by build_pyramid(). Tiles are read
+    from disk only when a view needs them, and the most recently used
+    ones are kept in memory.
+
+    Attributes:
+        - recording_path, sample_rate, length: the recording's path, sample
+          rate, and length in samples
+        - duration: the recording's length in seconds
+        - freqs: the frequencies of the spectrogram's rows, in Hz
+        - vmin, vmax: values for showing the whole pyramid, from the
+          distribution of level 0's values
+    '''
+
+    def __init__(self, dir_path):
+
+        with open(os.path.join(dir_path, _METADATA_FILE_NAME)) as file_:
+            metadata = json.load(file_)
+
+        if metadata['version'] != _METADATA_VERSION:
+            raise ValueError("Spectrogram pyramid '{}' is out of date".format(
+                dir_path))
+
+        self.dir_path = dir_path
+        self._metadata = metadata
+
+        self.recording_path = metadata['recording_path']
+        self.sample_rate = metadata['sample_rate']
+        self.length = metadata['length']
+        self.duration = self.length / self.sample_rate
+        self.freqs = np.array(metadata['freqs'])
+        self.vmin = metadata['vmin']
+        self.vmax = metadata['vmax']
+
+        self._step = metadata['step']
+        self._tile_frames = metadata['tile_frames']
+        self._level_frames = metadata['level_frames']
+
+        # Level 0 frames are centered half a frame after their first
+        # sample, and columns are drawn centered on them
+        self._offset = (metadata['settings']['nfft'] - self._step) / 2 / \
+            self.sample_rate
+
+        self._tiles = OrderedDict()
+
+    def is_current(self, settings, tile_frames):
+        '''Returns True if the pyramid was built with the given settings
+        from the recording as it is now'''
+        metadata = self._metadata
+        return metadata['settings'] == json.loads(json.dumps(settings)) and \
+            metadata['tile_frames'] == tile_frames and \
+            tuple(metadata['file_stamp']) == \
+                get_file_stamp(metadata['recording_path'])
+
+    @property
+    def num_levels(self):
+        return len(self._level_frames)
+
+    def get_view(self, start_time, end_time, max_columns):
+        '''
+        Returns the part of the spectrogram between two times in seconds,
+        from the coarsest level that still has at least max_columns
+        columns in that time, or level 0 if none does.
+
+        Returns (spectrum, freqs, (start time, end time)), where spectrum
+        is an array of frequencies by columns, with frequency increasing
+        along the first axis, and the times are those that the first and
+        last columns start and end at, which may be a little outside of
+        the times asked for.
+        '''
+
+        level = self._get_level(end_time - start_time, max_columns)
+        num_frames = self._level_frames[level]
+        column_duration = self._step * 2 ** level / self.sample_rate
+
+        start = int(np.floor((start_time - self._offset) / column_duration))
+        end = int(np.ceil((end_time - self._offset) / column_duration))
+        start = min(max(start, 0), num_frames - 1)
+        end = min(max(end, start + 1), num_frames)
+
+        tile_frames = self._tile_frames
+        first_tile = start // tile_frames
+        tiles = [self._get_tile(level, i)
+                 for i in range(first_tile, (end - 1) // tile_frames + 1)]
+
+        offset = first_tile * tile_frames
+        spectrum = np.concatenate(tiles, axis=1)[:, start - offset:end - offset]
+
+        times = (self._offset + start * column_duration,
+                 self._offset + end * column_duration)
+
+        return (spectrum, self.freqs, times)
+
+    def _get_level(self, duration, max_columns):
+        '''Returns the coarsest level with at least max_columns columns in
+        duration seconds, or 0 if no level has that many'''
+        level_0_columns = duration * self.sample_rate / self._step
+        level = int(np.floor(np.log2(max(level_0_columns / max_columns, 1))))
+        return min(level, self.num_levels - 1)
+
+    def _get_tile(self, level, index):
+
+        key = (level, index)
+        tile = self._tiles.pop(key, None)
+
+        if tile is None:
+            tile = _load_tile(self.dir_path, level, index)
+            if len(self._tiles) == _MAX_LOADED_TILES:
+                self._tiles.popitem(last=False)
+
+        self._tiles[key] = tile
+        return tile
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description='Build the spectrogram pyramids of recordings, for \
+            viewing them with recording_viewer.py.', add_help=True)
+    parser.add_argument('paths', nargs='+', metavar='PATH',
+        help='.wav files, or directories of .wav files')
+    parser.add_argument('--pyramid-dir', metavar='DIR', dest='pyramid_dir',
+        default=DEFAULT_PYRAMID_DIR,
+        help='directory to save pyramids in (default: {})'.format(
+            DEFAULT_PYRAMID_DIR))
+    input = vars(parser.parse_args())
+
+    logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
+
+    for path in input['paths']:
+        recording_paths = find_files(path) if os.path.isdir(path) else [path]
+        for recording_path in recording_paths:
+            pyramid = get_pyramid(recording_path, input['pyramid_dir'])
+            print("Pyramid of '{}' in '{}'".format(
+                recording_path, pyramid.dir_path))
+
+
+if __name__ == '__main__':
+    main()
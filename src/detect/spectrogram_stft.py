@@ -0,0 +1,231 @@
+'''
+spectrogram_stft.py
+
+Computing the spectrograms of many clips at once, with NumPy alone.
+
+Calling matplotlib's specgram() once per clip spends most of its time
+outside the FFT: checking arguments, framing and windowing one clip at
+a time, and building a plot. compute_spectrograms() instead takes a 2D
+batch of equal-length clips, frames all of them at once as strided
+views of the samples, and transforms every frame of the batch with a
+single call to numpy.fft.rfft.
+
+The spectrograms are the same as those specgram() plots by default:
+power spectral densities in dB, from Hann-windowed frames, with the
+same scaling, frame times and frequencies. They are returned as arrays
+instead of being drawn, so they can be rendered (see spectrogram_png.py),
+cached or analysed without matplotlib.
+
+specgram() scales the colors of its image to the least and greatest
+values of the whole spectrogram, even when only some frequencies are in
+view. compute_spectrograms() keeps only the frequencies in freq_range, so
+it can also return those limits, from all frequencies, for rendering the
+spectrograms with the same contrast as specgram() does.
+'''
+
+from collections import OrderedDict
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+# Settings used by spectrogram_utils.make_spectrogram()
+DEFAULT_SETTINGS = dict(nfft=512, noverlap=384, pad_to=1024,
+                        freq_range=(0, 10000))
+
+# Maximum number of values transformed at a time. Larger batches are split
+# by clip, so the frames of a huge batch are never all in memory at once.
+_MAX_CHUNK_SIZE = 2 ** 22
+
+
+def compute_spectrograms(clips, sample_rate, nfft=256, noverlap=128,
+    pad_to=None, freq_range=None, dtype='float64', return_limits=False):
+    '''
+    Computes the spectrograms of a batch of clips.
+
+    clips: a 2D array with one clip per row, or a 1D array for a single clip
+    sample_rate: the sample rate of the clips, in Hz
+    nfft: the number of samples in each frame
+    noverlap: the number of samples by which consecutive frames overlap
+    pad_to: the length to which each frame is padded with zeros before the
+        FFT, by default nfft
+    freq_range: a (min, max) pair of frequencies in Hz. Only frequencies
+        in the range, inclusive, are returned. By default all are.
+    dtype: the floating point type to compute and return spectrograms in.
+        'float32' takes half the memory.
+    return_limits: whether to return the limits of each spectrogram too
+
+    Returns (spectra, freqs, times), where spectra is an array of shape
+    (number of clips, number of frequencies, number of frames) holding
+    power spectral densities in dB (or, for a 1D clip, an array of shape
+    (number of frequencies, number of frames)), freqs is an array of the
+    frequencies of the spectra in Hz, and times is an array of the times
+    of the frame centers in seconds.
+
+    If return_limits is True, returns (spectra, freqs, times, limits),
+    where limits is an array of shape (number of clips, 2) (or, for a 1D
+    clip, of shape (2,)) holding the least and greatest finite values of
+    each spectrogram over all frequencies, not just those in freq_range,
+    in dB. The limits of a silent clip are (inf, -inf).
+    '''
+
+    clips = np.asarray(clips)
+    single = clips.ndim == 1
+    if single:
+        clips = clips[np.newaxis]
+
+    nfft = int(nfft)
+    noverlap = int(noverlap)
+    pad_to = int(pad_to) if pad_to is not None else nfft
+    step = nfft - noverlap
+    dtype = np.dtype(dtype)
+
+    # Clips shorter than a frame are padded with zeros, as by specgram()
+    num_clips, length = clips.shape
+    if length < nfft:
+        padded = np.zeros((num_clips, nfft), dtype=clips.dtype)
+        padded[:, :length] = clips
+        clips, length = padded, nfft
+
+    freqs = np.fft.rfftfreq(pad_to, 1 / sample_rate)
+    rows = _get_freq_rows(freqs, freq_range)
+    freqs = freqs[rows]
+
+    times = np.arange(nfft / 2, length - nfft / 2 + 1, step) / sample_rate
+
+    window = np.hanning(nfft).astype(dtype)
+    scale = _get_psd_scale(window, pad_to, sample_rate).astype(dtype)
+
+    # Frames are views of the clips, copied only when windowed
+    frames = sliding_window_view(clips, nfft, axis=-1)[:, ::step]
+    num_frames = frames.shape[1]
+
+    spectra = np.empty((num_clips, len(freqs), num_frames), dtype=dtype)
+    limits = np.empty((num_clips, 2), dtype=dtype)
+
+    chunk_size = max(_MAX_CHUNK_SIZE // (num_frames * pad_to), 1)
+
+    for start in range(0, num_clips, chunk_size):
+
+        chunk = slice(start, start + chunk_size)
+
+        windowed = np.multiply(frames[chunk], window, dtype=dtype)
+        spectrum = np.fft.rfft(windowed, n=pad_to, axis=-1)
+
+        # The power of every frequency is only needed for the limits
+        if return_limits:
+            power = np.square(spectrum.real)
+            power += np.square(spectrum.imag)
+            _get_limits(power, scale, out=limits[chunk])
+            power = power[..., rows]
+            power *= scale[rows]
+        else:
+            spectrum = spectrum[..., rows]
+            power = np.square(spectrum.real)
+            power += np.square(spectrum.imag)
+            power *= scale[rows]
+
+        # Silent frames have a power of zero, or -inf dB, as in specgram()
+        with np.errstate(divide='ignore'):
+            np.log10(power, out=power)
+        power *= 10
+
+        spectra[chunk] = power.transpose(0, 2, 1)
+
+    if single:
+        spectra = spectra[0]
+        limits = limits[0]
+
+    if return_limits:
+        return (spectra, freqs, times, limits)
+    return (spectra, freqs, times)
+
+
+def _get_limits(power, scale, out):
+    '''
+    Finds the least and greatest finite values in dB of each of a batch
+    of power spectra, before they are scaled by scale (see
+    _get_psd_scale()), those of zero power being -inf dB.
+
+    Scaling every power just for its limits would take longer than the
+    FFT, so the limits are found in the three groups of frequencies that
+    _get_psd_scale() scales alike, and only those are scaled.
+    '''
+
+    num_clips = len(power)
+    mins = np.full(num_clips, np.inf)
+    maxes = np.zeros(num_clips)
+
+    for group in (slice(0, 1), slice(1, -1), slice(-1, None)):
+
+        part = power[..., group]
+        if part.size == 0:
+            continue
+        factor = scale[group][0]
+
+        part_mins = part.min(axis=(1, 2))
+
+        # Zero powers are left out, which is slower, so only if there are any
+        silent = part_mins == 0
+        if np.any(silent):
+            part_mins[silent] = np.min(part[silent], axis=(1, 2),
+                initial=np.inf, where=part[silent] > 0)
+
+        np.minimum(mins, part_mins * factor, out=mins)
+        np.maximum(maxes, part.max(axis=(1, 2)) * factor, out=maxes)
+
+    out[:, 0] = mins
+    out[:, 1] = maxes
+    with np.errstate(divide='ignore'):
+        np.log10(out, out=out)
+    out *= 10
+
+
+def _get_freq_rows(freqs, freq_range):
+    '''Returns a slice of the frequencies in freq_range'''
+    if freq_range is None:
+        return slice(None)
+    (min_freq, max_freq) = freq_range
+    start = np.searchsorted(freqs, min_freq, side='left')
+    end = np.searchsorted(freqs, max_freq, side='right')
+    return slice(int(start), int(end))
+
+
+def _get_psd_scale(window, pad_to, sample_rate):
+    '''
+    Returns the factors by which the power of each frequency is scaled to
+    make a one-sided power spectral density, as in matplotlib.mlab.
+
+    Like mlab, this doubles every power except that of frequency zero and,
+    when nfft (not pad_to) is even, that of the last frequency.
+    '''
+
+    scale = np.full(pad_to // 2 + 1,
+                    1 / (sample_rate * np.sum(window.astype('float64') ** 2)))
+
+    if len(window) % 2 == 0:
+        scale[1:-1] *= 2
+    else:
+        scale[1:] *= 2
+
+    return scale
+
+
+def group_by_length(clips):
+    '''
+    Groups clips of different lengths into batches for
+    compute_spectrograms().
+
+    clips: a sequence of 1D sample arrays
+
+    Returns a list of (indices, batch) pairs, one for each clip length,
+    where batch is a 2D array of the clips of that length and indices
+    lists their positions in clips.
+    '''
+
+    groups = OrderedDict()
+    for i, clip in enumerate(clips):
+        groups.setdefault(len(clip), []).append(i)
+
+    return [(indices, np.stack([clips[i] for i in indices]))
+            for indices in groups.values()]
@@ -7,6 +7,7 @@ Utilities for creating and exporting spectrograms.
 
 ### Imports ###
 from matplotlib.figure import Figure
+import numpy as np
 
 # For finding filename within path
 from ntpath import basename 
@@ -14,6 +15,10 @@ from ntpath import basename
 # For reading samples from wave files
 from audio_file_utils import read_wave_file
 
+# For making spectrogram images without matplotlib
+from spectrogram_stft import compute_spectrograms, DEFAULT_SETTINGS
+from spectrogram_png import spectrogram_to_image, write_png
+
 ### Scripts ###
 def make_spectrogram(origin_file, figure, axes, points=512, pad=75):
     '''Updates the data of a given axis with a spectrogram 
@@ -29,7 +34,7 @@ def make_spectrogram(origin_file, figure, axes, points=512, pad=75):
         samples,
         Fs = 96000,
         NFFT = points, # window size
-        noverlap = .75*points,
+        noverlap = int(.75*points),
         pad_to = 1024,
         cmap = 'gray_r', # gray color map
     )
@@ -41,6 +46,60 @@ def make_spectrogram(origin_file, figure, axes, points=512, pad=75):
     figure.subplots_adjust(left=0, right=1, bottom=0, top=1)   
     
     return figure
+
+def load_spectrogram(origin_file, cache=None, settings=DEFAULT_SETTINGS):
+    '''Returns the spectrogram of the first channel of a .wav file as a
+    (spectrum, freqs, times, limits) tuple (see spectrogram_stft), from a 
+    spectrogram_cache.SpectrogramCache if one is given'''
+    
+    (samples, sample_rate) = read_wave_file(origin_file)
+    
+    if cache is not None:
+        return cache.get_spectrogram(samples[0], sample_rate, settings)
+    return compute_spectrograms(samples[0], sample_rate, return_limits=True,
+        **settings)
+
+def plot_spectrogram(spectrogram, figure, axes):
+    '''Plots a spectrogram from load_spectrogram() on a given axis as 
+    make_spectrogram() does, returning the image. The image can be reused
+    for other spectrograms (see update_spectrogram())'''
+    
+    spectrum, freqs, t, limits = spectrogram
+    
+    im = axes.imshow(np.flipud(spectrum), cmap='gray_r', aspect='auto',
+        extent=_get_extent(freqs, t))
+    _set_limits(im, limits)
+    
+    # Remove axis ticks/labels and remove whitespace
+    figure.subplots_adjust(left=0, right=1, bottom=0, top=1)
+    
+    return im
+
+def update_spectrogram(image, spectrogram):
+    '''Shows a spectrogram from load_spectrogram() in an image made by
+    plot_spectrogram(), which is much faster than plotting it anew. The
+    figure is not redrawn'''
+    
+    spectrum, freqs, t, limits = spectrogram
+    
+    image.set_data(np.flipud(spectrum))
+    image.set_extent(_get_extent(freqs, t))
+    _set_limits(image, limits)
+
+def _set_limits(image, limits):
+    '''Scales the colors of an image to the limits of a spectrogram, which
+    are those of all its frequencies, as in make_spectrogram(), rather 
+    than just of those shown'''
+    if np.all(np.isfinite(limits)):
+        image.set_clim(*limits)
+
+def _get_extent(freqs, t):
+    '''Returns the extent of the image of a spectrogram'''
+    
+    # Frames cover the times halfway to their neighbors, as in specgram()
+    pad = (t[1] - t[0]) / 2 if len(t) > 1 else t[0]
+    
+    return (t[0] - pad, t[-1] + pad, freqs[0], freqs[-1])
       
 def save_spectrogram(origin_file, destination_path, fig):
     '''Saves a figure with a similar name as its .wav origin file
@@ -53,3 +112,20 @@ def save_spectrogram(origin_file, destination_path, fig):
     
     # Save fig to specified path
     fig.savefig(file_path)
+
+
+def render_spectrogram(origin_file, destination_path, size=(640, 480),
+    cache=None):
+    '''Saves the spectrogram of a .wav file as save_spectrogram() saves a
+    figure made by make_spectrogram(), but without matplotlib, which is
+    many times faster. size is the (width, height) of the image in pixels,
+    and the spectrogram is taken from cache if given (see 
+    load_spectrogram())'''
+    
+    spectrum, freqs, t, (vmin, vmax) = load_spectrogram(origin_file, cache)
+    
+    filename = basename(origin_file).replace('.wav', '')
+    file_path = destination_path+filename+".png"
+    
+    write_png(file_path, 
+        spectrogram_to_image(spectrum, vmin, vmax, size=size))
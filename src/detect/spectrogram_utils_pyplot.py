@@ -10,6 +10,13 @@ from scipy import signal
 import matplotlib.pyplot as plt
 from audio_file_utils import read_wave_file
 
+# For making spectrogram images without matplotlib
+from spectrogram_stft import compute_spectrograms
+from spectrogram_png import spectrogram_to_image, write_png
+
+# Settings used by make_speck(), for compute_spectrograms()
+SPECK_SETTINGS = dict(nfft=450, noverlap=128, pad_to=512, freq_range=(0, 2000))
+
 # For finding filename within path
 from ntpath import basename 
     
@@ -65,6 +72,22 @@ def save_speck(origin_file, destination_path, fig):
     fig.savefig(file_path)
     
     
+def render_speck(origin_file, destination_path, size=(100, 100)):
+    '''Saves the spectrogram of a .wav file as save_speck() saves a figure
+    made by make_speck(), but without matplotlib, which is many times 
+    faster. size is the (width, height) of the image in pixels'''
+    
+    (samples, sample_rate) = read_wave_file(origin_file)
+    spectrum, freqs, t, (vmin, vmax) = compute_spectrograms(
+        samples[0], sample_rate, return_limits=True, **SPECK_SETTINGS)
+    
+    filename = basename(origin_file).replace('.wav', '')
+    file_path = destination_path+filename+".png"
+    
+    write_png(file_path, 
+        spectrogram_to_image(spectrum, vmin, vmax, size=size))
+    
+    
 def test_spec_settings(filename):
     '''
     filename: path to a .wav file